@@ -20,18 +20,51 @@
 
 
 import os
-import urllib.request
+import http.client
 import base64
 import json
 import time
 import sys
 import socket
 import ssl
+import selectors
 import traceback
 import html
 import errno
-from xmlrpc.client import ServerProxy
-from operator import itemgetter
+import itertools
+import io
+import hashlib
+import heapq
+import bisect
+import queue
+import subprocess
+import threading
+import gzip
+import bz2
+import zlib
+from array import array
+from email.utils import parsedate_to_datetime
+from collections import deque, namedtuple
+from operator import attrgetter, itemgetter
+
+try:
+    from compression import zstd  # python 3.14+
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None  # zstd compressed NZB files not supported
+
+# errors of reading a damaged (compressed) NZB file
+NZB_READ_ERRORS = (OSError, EOFError, ValueError, zlib.error)
+if zstd is not None and hasattr(zstd, "ZstdError"):
+    NZB_READ_ERRORS += (zstd.ZstdError,)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
+    import msvcrt
 
 sys.stdout.reconfigure(encoding="utf-8")
 
@@ -77,24 +110,84 @@ CHECK_LIMIT = int(os.environ.get("NZBPO_CheckLimit", 10))
 MAX_ARTICLES = int(os.environ.get("NZBPO_MaxArticles", 1000))
 MIN_ARTICLES = int(os.environ.get("NZBPO_MinArticles", 50))
 FULL_CHECK_NO_PARS = os.environ.get("NZBPO_FullCheckNoPars", "Yes") == "Yes"
+SWEEP_SIZE = int(os.environ.get("NZBPO_SweepSize", 1))
+MAX_CHECK_TIME = int(os.environ.get("NZBPO_MaxCheckTime", 0))
+MAX_NZB_CHECK_TIME = int(os.environ.get("NZBPO_MaxNzbCheckTime", 0))
+SERVER_ORDER = os.environ.get("NZBPO_ServerOrder", "Level")
+GROUP_MIRRORS = os.environ.get("NZBPO_GroupMirrors", "No") == "Yes"
+OVERVIEW_AGE = int(os.environ.get("NZBPO_OverviewAge", 0))
+OVERVIEW_AGE_SEC = 3600 * OVERVIEW_AGE
+OVERVIEW_SPAN_SEC = 2 * 3600  # overview data read before / after the post age
+OVERVIEW_BATCH = 10000  # articles per XOVER request
+OVERVIEW_MAX_ARTICLES = 200000  # articles per group read at most
+BREAKER_FAILURES = 3  # failed checks in a row before a news server is skipped
+BREAKER_COOLDOWN_SEC = 600  # first wait before a skipped server is tried again
+BREAKER_MAX_COOLDOWN_SEC = 6 * 3600
+SERVER_STATS_AGE_BUCKETS = (1, 6, 24, 168, 720)  # hours of post age
+SERVER_STATS_MIN = 50  # STAT requests before ordering on the stats
+SERVER_STATS_MAX = 10000  # halve the older stats
+DAEMON = os.environ.get("NZBPO_Daemon", "No") == "Yes"
+DAEMON_IDLE_SEC = 900  # daemon exits when no events are received
+DAEMON_START_TIME_OUT = 10  # wait for the daemon to accept events
+DAEMON_EVENT_ENV = ("NZBNA_", "NZBSP_", "NZBCP_")  # env send with the event
+EVENT_TMP_MAX_AGE_SEC = 60  # remove events left half written by a failed call
+NZB_READ_CHUNK = 65536  # chars read from the (decompressed) NZB at once
+PLAN_MAX_AGE_SEC = 7 * 24 * 3600  # prune check plans of removed NZBs
+PRIO_LIST_MAX = 50  # NZBs listed in the Verbose log of a check
+RESULT_CACHE_TTL_SEC = 24 * 3600  # check results used for NZBs added again
+RESULT_CONFIRM_ARTICLES = 20  # articles checked to confirm an earlier result
+TAKEDOWN_MAX = 200000  # known taken down message ids, 8 bytes each
+TAKEDOWN_CONFIRM_ARTICLES = 5  # known takedowns checked again before use
 NNTP_TIME_OUT = 2  # low, but should be sufficient for connection check
 SOCKET_CREATE_INTERVAL = 0.000  # optional delay to avoid handshake time outs
 SOCKET_LOOP_INTERVAL = 0.200  # max delay single loop on data received
+NNTP_REPLY_TIME_OUT = 3  # close the connection when no reply in time
+HEDGE_MIN_REPLIES = 20  # replies before slow requests are send again
+NNTP_RECONNECTS = 3  # new connections for a connection lost during a check
 HOST = os.environ["NZBOP_CONTROLIP"]  # NZBGet host
 if HOST == "0.0.0.0":
     HOST = "127.0.0.1"  # fix to localhost
 PORT = os.environ["NZBOP_CONTROLPORT"]  # NZBGet port
 USERNAME = os.environ["NZBOP_CONTROLUSERNAME"]  # NZBGet username
 PASSWORD = os.environ["NZBOP_CONTROLPASSWORD"]  # NZBGet password
+RPC_TIME_OUT = 120  # NZBGet RPC-API, large history / listgroups replies
+RPC_IDLE_SEC = 3  # reconnect before an edit on a connection idle this long
+# RPC-API methods that can be send again when the reply is lost
+RPC_RETRY_METHODS = (
+    "status",
+    "listgroups",
+    "history",
+    "listfiles",
+    "pausedownload",
+    "resumedownload",
+)
+RPC_AUTHORIZATION = "Basic " + base64.b64encode(
+    ("%s:%s" % (USERNAME, PASSWORD)).encode("utf-8")
+).decode("utf-8")
+rpc_connection = None  # keep-alive HTTP connection to NZBGet, shared per process
+rpc_last_use = 0  # time of the last reply on rpc_connection
+rpc_ids = itertools.count(1)  # JSON-RPC request ids
+edit_queue = []  # editqueue commands for send_edits()
+status_snapshot = None  # NZBGet status of this run, see nzbget_status()
+server_table = None  # news server settings of this run, see get_server_table()
+history_index = None  # DUPEs in the history of this run, see get_history_index()
+stat_results = {}  # (server id, msg id) -> found, STATs of this run
+lock_fd = None  # completion.lock while held, see lock_file()
+server_stats = None  # STAT stats of the news servers, see get_server_stats()
+breakers = None  # failed news servers, see get_breakers()
+overview_cache = {}  # (server, group) -> (from, to, msg ids), see check_overview()
+result_cache = None  # earlier check results by NZB content, see get_result_cache()
+takedown_log = None  # hashes of taken down msg ids, in order, see get_takedowns()
+takedown_hashes = None  # same hashes sorted, for bisect
+check_deadline = None  # end of the MaxCheckTime of the get_prio_nzb() run
 
 
 def unpause_nzb(nzb_id):
     """
     resume the nzb with NZBid in the NZBGet queue via RPC-API
     """
-    NZBGet = connect_to_nzbget()
-    NZBGet.editqueue("GroupResume", 0, "", [int(nzb_id)])  # Resume nzb
-    NZBGet.editqueue("GroupPauseExtraPars", 0, "", [int(nzb_id)])  # Pause pars
+    queue_edit("GroupResume", "", [int(nzb_id)])  # Resume nzb
+    queue_edit("GroupPauseExtraPars", "", [int(nzb_id)])  # Pause pars
 
 
 def unpause_nzb_dupe(dupe_nzb_id, nzb_id):
@@ -102,24 +195,22 @@ def unpause_nzb_dupe(dupe_nzb_id, nzb_id):
     resume the nzb with NZBid in the NZBGet history via RPC-API, move the
     other one to history.
     """
-    NZBGet = connect_to_nzbget()
     # Return item from history (before deleting, to avoid NZBGet automatically
     # returning a DUPE instead of the script).
-    NZBGet.editqueue("HistoryRedownload", 0, "", [int(dupe_nzb_id)])  # Return
-    NZBGet.editqueue("GroupResume", 0, "", [int(dupe_nzb_id)])  # Resume nzb
+    queue_edit("HistoryRedownload", "", [int(dupe_nzb_id)])  # Return
+    queue_edit("GroupResume", "", [int(dupe_nzb_id)])  # Resume nzb
     # Pause pars
-    NZBGet.editqueue("GroupPauseExtraPars", 0, "", [int(dupe_nzb_id)])
+    queue_edit("GroupPauseExtraPars", "", [int(dupe_nzb_id)])
     # Remove item in queue, send back to history as DUPE
-    NZBGet.editqueue("GroupDupeDelete", 0, "", [int(nzb_id)])
+    queue_edit("GroupDupeDelete", "", [int(nzb_id)])
 
 
 def mark_bad(nzb_id):
     """
     mark the nzb with NZBid BAD in the NZBGet queue via RPC-API
     """
-    NZBGet = connect_to_nzbget()
-    NZBGet.editqueue("GroupDelete", 0, "", [int(nzb_id)])  # need to delete
-    NZBGet.editqueue("HistoryMarkBad", 0, "", [int(nzb_id)])  # mark bad
+    queue_edit("GroupDelete", "", [int(nzb_id)])  # need to delete
+    queue_edit("HistoryMarkBad", "", [int(nzb_id)])  # mark bad
 
 
 def mark_bad_dupe(dupe_nzb_id):
@@ -127,8 +218,7 @@ def mark_bad_dupe(dupe_nzb_id):
     mark the nzb with NZBid BAD in the NZBGet history via RPC-API, item is
     already in history, so no moving.
     """
-    NZBGet = connect_to_nzbget()
-    NZBGet.editqueue("HistoryMarkBad", 0, "", [int(dupe_nzb_id)])  # mark bad
+    queue_edit("HistoryMarkBad", "", [int(dupe_nzb_id)])  # mark bad
 
 
 def force_failure(nzb_id):
@@ -140,8 +230,9 @@ def force_failure(nzb_id):
     """
     if VERBOSE:
         print("[V] force_failure(nzb_id=" + str(nzb_id) + ")")
-    NZBGet = connect_to_nzbget()
-    data = NZBGet.listfiles(0, 0, [int(nzb_id)])
+    # the file list is only complete after the queued commands are handled
+    send_edits()
+    data = nzbget_listfiles(nzb_id)
     id_list = []
     file_size_low = 100000000000  # 100 Gb, file size will never occur.
     par_size_low = 100000000000
@@ -169,9 +260,9 @@ def force_failure(nzb_id):
     sys.stdout.flush()  # force message before lot of NZBGet messages
     time.sleep(0.1)  # create time to flush
     # delete all listed files
-    NZBGet.editqueue("FileDelete", 0, "", id_list)
+    queue_edit("FileDelete", "", id_list)
     # Resume nzb in queue to download single remaining file in NZB
-    NZBGet.editqueue("GroupResume", 0, "", nzb_id)
+    queue_edit("GroupResume", "", [int(nzb_id)])
 
 
 def force_failure_dupe(dupe_nzb_id):
@@ -184,62 +275,331 @@ def force_failure_dupe(dupe_nzb_id):
     """
     if VERBOSE:
         print("[V] force_failure_dupe(nzb_id=" + str(dupe_nzb_id) + ")")
-    NZBGet = connect_to_nzbget()
     if VERBOSE:
         print("[V] Pausing failed DUPE NZB before returning to queue.")
     # pause all files before returning to queue
-    NZBGet.editqueue("GroupPause", 0, "", dupe_nzb_id)
+    queue_edit("GroupPause", "", [int(dupe_nzb_id)])
     if VERBOSE:
         print("[V] Returning failed DUPE NZB to queue.")
     # return item back to queue to be able to force a failure
-    NZBGet.editqueue("HistoryReturn", 0, "", dupe_nzb_id)
+    queue_edit("HistoryReturn", "", [int(dupe_nzb_id)])
     force_failure(dupe_nzb_id)
 
 
-def connect_to_nzbget():
+def queue_edit(command, param, ids):
     """
-    Establish connection to NZBGet via RPC-API using HTTP.
+    Add an editqueue command to the batch that is send to NZBGet by
+    send_edits(), once all commands of a decision are known.
     """
-    # Build an URL for XML-RPC requests:
-    xmlRpcUrl = "http://%s:%s@%s:%s/xmlrpc" % (USERNAME, PASSWORD, HOST, PORT)
-    # Create remote server object
-    NZBGet = ServerProxy(xmlRpcUrl)
-    return NZBGet
+    edit_queue.append((command, param, ids))
 
 
-def call_nzbget_direct(url_command):
+def send_edits():
     """
-    Connect to NZBGet and call an RPC-API-method without using of python's
-    XML-RPC. XML-RPC is easy to use but it is slow for large amounts of
-    data.
+    Send all queued editqueue commands to NZBGet in a single
+    system.multicall request. NZBGet handles them in order, so the queue is
+    never seen in a half updated state, and a decision takes one round trip.
     """
-    # Building http-URL to call the method
-    http_url = "http://%s:%s/jsonrpc/%s" % (HOST, PORT, url_command)
-    request = urllib.request.Request(http_url)
-    base_64_string = (
-        base64.b64encode(("%s:%s" % (USERNAME, PASSWORD)).encode("utf-8"))
-        .decode("utf-8")
-        .strip()
+    global edit_queue
+    if not edit_queue:
+        return
+    edits = edit_queue
+    edit_queue = []
+    if VERBOSE:
+        print("[V] send_edits(): " + str(edits))
+    if len(edits) == 1:
+        command, param, ids = edits[0]
+        try:
+            nzbget_editqueue(command, param, ids)
+        except NZBGetError as e:
+            print(f"[ERROR] Error on {command} {param} for {ids}: {e}")
+        return
+    results = nzbget_multicall(
+        [("editqueue", [command, 0, param, ids]) for command, param, ids in edits]
     )
-    request.add_header("Authorization", "Basic %s" % base_64_string)
-    response = urllib.request.urlopen(request)  # get some data from NZBGet
-    # data is a JSON raw-string, contains ALL properties each NZB in queue
-    data = response.read().decode("utf-8")
-    return data
+    for (command, param, ids), result in zip(edits, results):
+        if isinstance(result, dict):  # fault struct
+            print(
+                f"[ERROR] Error on {command} {param} for {ids}: "
+                + str(result.get("faultString"))
+            )
 
 
-def get_nzb_filename(parameters):
+def nzbget_request(method, url, body=None, content_type=None, retry=True):
     """
-    get the real nzb_filename from the added parameter CnpNZBFileName or from env
+    Send a HTTP request to the RPC-API of NZBGet over the keep-alive
+    connection shared by all calls, and return the raw reply. A connection
+    that was closed by NZBGet while idle is reconnected once. Without
+    retry, e.g. for edits, the request is not send again once it is send:
+    NZBGet may have handled it. Such requests use a new connection when the
+    connection is idle for RPC_IDLE_SEC.
     """
-    file_name = os.environ.get("NZBNA_QUEUEDFILE")
-    if file_name:
-        return file_name
+    global rpc_connection, rpc_last_use
+    headers = {"Authorization": RPC_AUTHORIZATION, "Connection": "keep-alive"}
+    if content_type:
+        headers["Content-Type"] = content_type
+    if (
+        not retry
+        and rpc_connection is not None
+        and time.time() - rpc_last_use > RPC_IDLE_SEC
+    ):
+        rpc_connection.close()
+        rpc_connection = None
+    while True:
+        reused = rpc_connection is not None
+        if not reused:
+            rpc_connection = http.client.HTTPConnection(
+                HOST, int(PORT), timeout=RPC_TIME_OUT
+            )
+        send = False
+        try:
+            rpc_connection.request(method, url, body, headers)
+            send = True
+            response = rpc_connection.getresponse()
+            data = response.read()
+        except (
+            http.client.RemoteDisconnected,
+            ConnectionResetError,
+            BrokenPipeError,
+        ) as e:
+            # stale keep-alive connection, request was not handled by NZBGet
+            rpc_connection.close()
+            rpc_connection = None
+            if not reused or (send and not retry):
+                raise
+            if VERBOSE:
+                print("[V] Reconnecting to NZBGet: " + str(e))
+            continue
+        except (http.client.HTTPException, OSError):
+            rpc_connection.close()
+            rpc_connection = None
+            raise
+        rpc_last_use = time.time()
+        if response.status != 200:
+            raise http.client.HTTPException(
+                "NZBGet RPC-API error %d %s" % (response.status, response.reason)
+            )
+        return data
+
+
+class NZBGetError(Exception):
+    """
+    Error reply on a RPC-API call from NZBGet.
+    """
+
+
+def call_nzbget(method, *params):
+    """
+    Call an RPC-API-method of NZBGet via JSON-RPC, and return the result.
+    JSON-RPC is used for all calls, the XML marshalling of python's XML-RPC
+    is slow for large amounts of data.
+    """
+    request = json.dumps(
+        {"method": method, "params": list(params), "id": next(rpc_ids)}
+    )
+    data = nzbget_request(
+        "POST",
+        "/jsonrpc",
+        request.encode("utf-8"),
+        "application/json",
+        method in RPC_RETRY_METHODS,
+    )
+    reply = json.loads(data)
+    if reply.get("error"):
+        raise NZBGetError(str(reply["error"].get("message", reply["error"])))
+    return reply["result"]
+
+
+def nzbget_multicall(calls):
+    """
+    Call multiple RPC-API-methods in a single request, calls is a list of
+    (method, params). NZBGet only supports system.multicall via XML-RPC,
+    so xmlrpc.client is only loaded here. Returns a list with for each call
+    its result, or a fault struct (dict) when the call failed.
+    """
+    import xmlrpc.client
+
+    request = xmlrpc.client.dumps(
+        ([{"methodName": m, "params": p} for m, p in calls],), "system.multicall"
+    )
+    # edits, not send again when the reply is lost
+    data = nzbget_request(
+        "POST", "/xmlrpc", request.encode("utf-8"), "text/xml", retry=False
+    )
+    results = xmlrpc.client.loads(data)[0][0]
+    return [r[0] if isinstance(r, list) else r for r in results]
+
+
+def nzbget_status(refresh=False):
+    """
+    status of NZBGet: server time, download rate, news servers etc. The
+    status is fetched once per run and shared by nzbget_paused() and
+    get_server_settings(), refresh is used to get fields that change
+    during the run, like DownloadRate.
+    """
+    global status_snapshot
+    if status_snapshot is None or refresh:
+        status_snapshot = call_nzbget("status")
+    return status_snapshot
+
+
+def nzbget_listgroups():
+    """
+    all NZBs in the queue, with ALL properties of each NZB
+    """
+    return call_nzbget("listgroups", 0)
+
+
+def nzbget_history():
+    """
+    all items in the history, with ALL properties of each item
+    """
+    return call_nzbget("history", False)
+
+
+def nzbget_listfiles(nzb_id):
+    """
+    files of the NZB with NZBid in the queue
+    """
+    return call_nzbget("listfiles", 0, 0, int(nzb_id))
+
+
+def nzbget_editqueue(command, param, ids):
+    """
+    edit queue / history items, see queue_edit() for batched edits
+    """
+    return call_nzbget("editqueue", command, 0, param, [int(i) for i in ids])
+
+
+def nzbget_pausedownload():
+    return call_nzbget("pausedownload")
+
+
+def nzbget_resumedownload():
+    return call_nzbget("resumedownload")
+
+
+# NZB in the queue or history, the first fields match the nzb list used by
+# get_nzb_status()
+NzbJob = namedtuple(
+    "NzbJob",
+    "nzb_id filename age critical_health dupe_key dupe_score status priority "
+    + "first_post",
+)
+
 
+def get_cnp_filename(parameters):
+    """
+    get the value of the parameter CnpNZBFileName added by scan_call(), None
+    when the NZB is not paused by the script
+    """
     for p in parameters:
         if p["Name"] == "CnpNZBFileName":
-            break
-    return p["Value"]
+            return p["Value"]
+    return None
+
+
+def make_nzb_job(item):
+    """
+    NzbJob record of a listgroups / history item
+    """
+    return NzbJob(
+        item["NZBID"],
+        get_cnp_filename(item["Parameters"]),
+        item["MaxPostTime"],  # nzb age
+        item["CriticalHealth"],
+        item["DupeKey"],  # if empty returns u''
+        item["DupeScore"],
+        item["Status"],
+        item.get("MaxPriority", 0),
+        item.get("MinPostTime", item["MaxPostTime"]),  # post time of the 1st article
+    )
+
+
+class QueueSnapshot:
+    """
+    NZBs in the NZBGet queue, built in a single pass over the listgroups
+    data, and indexed by status and on being paused by the script.
+    """
+
+    __slots__ = ("jobs", "by_status", "script_jobs")
+
+    def __init__(self, items):
+        self.jobs = []
+        self.by_status = {}
+        self.script_jobs = []  # NZBs with CnpNZBFileName
+        for item in items:
+            job = make_nzb_job(item)
+            self.jobs.append(job)
+            self.by_status.setdefault(job.status, []).append(job)
+            if job.filename is not None:
+                self.script_jobs.append(job)
+
+    def paused_script_jobs(self):
+        """
+        NZBs paused by the script, that should be checked
+        """
+        return [j for j in self.by_status.get("PAUSED", []) if j.filename is not None]
+
+
+def get_queue():
+    """
+    QueueSnapshot of the NZBGet queue
+    """
+    # data contains ALL properties each NZB in queue
+    return QueueSnapshot(nzbget_listgroups())
+
+
+def get_history_index():
+    """
+    DELETED/DUPE NZBs in the NZBGet history that were paused by the script,
+    by DupeKey. The history is fetched once per run and shared by the DUPE
+    checks of all NZBs. The DUPEs of each DupeKey are sorted on dupescore,
+    then on nzb age, so higher score items will be on top, and within the
+    same score the oldest file (lowest maxposttime) first.
+    """
+    global history_index
+    if history_index is not None:
+        return history_index
+    history_index = {}
+    for item in nzbget_history():
+        if item["Status"] != "DELETED/DUPE":
+            continue
+        job = make_nzb_job(item)
+        if job.filename is not None:
+            history_index.setdefault(job.dupe_key, []).append(job)
+    for jobs in history_index.values():
+        jobs.sort(key=lambda j: (-j.dupe_score, j.age))
+    if VERBOSE:
+        print(
+            "[V] History index: "
+            + str(sum(len(jobs) for jobs in history_index.values()))
+            + " DUPEs for "
+            + str(len(history_index))
+            + " dupe keys."
+        )
+    return history_index
+
+
+def drop_history_job(job):
+    """
+    Remove a DUPE from the history index after it is returned to the queue
+    or marked BAD during this run.
+    """
+    jobs = history_index.get(job.dupe_key, [])
+    if job in jobs:
+        jobs.remove(job)
+
+
+def get_nzb_filename(job):
+    """
+    get the real nzb_filename from the added parameter CnpNZBFileName or from env
+    """
+    file_name = os.environ.get("NZBNA_QUEUEDFILE")
+    nzb_id = os.environ.get("NZBNA_NZBID")
+    if file_name and (nzb_id is None or nzb_id == str(job.nzb_id)):
+        return file_name  # only the NZB of the queue event
+    return job.filename
 
 
 def set_pp_parameters(nzb_id, params) -> None:
@@ -250,41 +610,28 @@ def set_pp_parameters(nzb_id, params) -> None:
     if not params:
         return
 
-    try:
-        NZBGet = connect_to_nzbget()
-    except Exception as e:
-        print(f"[ERROR] Failed to connect to NZBGet: {e}")
-        return
-
     if VERBOSE:
         print(f"[V] Setting post-processing parameters for group {nzb_id}: {str(params)}")
 
     for param in params:
-        try:
-            NZBGet.editqueue("GroupSetParameter", 0, param, [int(nzb_id)])
-        except Exception as e:
-            print(f"[ERROR] Error setting parameter {param} for {nzb_id}: {e}")
+        queue_edit("GroupSetParameter", param, [int(nzb_id)])
 
 
 def get_max_failed_limit(critical_health) -> float:
     return round(100 - critical_health / 10.0, 1)
 
 
-def get_nzb_status(nzb):
+def prepare_nzb_check(nzb, name=None):
     """
-    check if amount of failed articles is not too much. If too much keep
-    paused, if too old and too much failure mark bad / force failure,
-    otherwise resume. When an -1 or -2 is returned from check_nzb(), the
-    nzb is unpaused, hoping NZBGet can still process the file, while the
-    script can't.
+    collect the articles of the nzb that need to be checked. When an -1, -2
+    or -3 is returned from get_nzb_data(), the nzb is unpaused, hoping
+    NZBGet can still process the file, while the script can't, and None is
+    returned.
     """
-    if VERBOSE:
-        print("[V] get_nzb_status(nzb=" + str(nzb) + ")")
     print('Checking: "' + nzb[1] + '"')
     # collect rar msg ids that need to be checked
     rar_msg_ids = get_nzb_data(nzb[1])
     if rar_msg_ids == -1:  # no such NZB file
-        success = True  # file send back to queue
         print(
             "[WARNING] The NZB file "
             + str(nzb[1])
@@ -292,8 +639,8 @@ def get_nzb_status(nzb):
             + "exist, resuming NZB."
         )
         unpause_nzb(nzb[0])  # unpause based on NZBGet ID
+        return None
     elif rar_msg_ids == -2:  # empty NZB or no group
-        success = True  # file send back to queue
         print(
             "[WARNING] The NZB file "
             + str(nzb[1])
@@ -301,8 +648,8 @@ def get_nzb_status(nzb):
             + "invalid, resuming NZB."
         )
         unpause_nzb(nzb[0])  # unpause based on NZBGet ID
+        return None
     elif rar_msg_ids == -3:  # NZB without RAR files.
-        success = True  # file send back to queue
         print(
             "[WARNING] The NZB file "
             + str(nzb[1])
@@ -310,70 +657,156 @@ def get_nzb_status(nzb):
             + "any .rar files and has been moved back to the queue."
         )
         unpause_nzb(nzb[0])  # unpause based on NZBGet ID
-    else:
-        failed_limit = get_max_failed_limit(nzb[3])
-        print("Maximum failed articles limit for NZB: " + str(failed_limit) + "%")
-        if MAX_FAILURE > 0:
-            print(
-                "Maximum failed articles limit for highest level news server: "
-                + str(MAX_FAILURE)
-                + "%"
-            )
-        failed_ratio = check_failure_status(rar_msg_ids, failed_limit, nzb[2])
-        if VERBOSE:
-            print("[V] Total failed ratio: " + str(round(failed_ratio, 1)) + "%")
-        if (
-            failed_ratio < failed_limit
-            and (failed_ratio < MAX_FAILURE or MAX_FAILURE == 0)
-        ) or failed_ratio == 0:
-            success = True
-            print('Resuming: "' + nzb[1] + '"')
-            sys.stdout.flush()
+        return None
+    failed_limit = get_max_failed_limit(nzb[3])
+    print("Maximum failed articles limit for NZB: " + str(failed_limit) + "%")
+    if MAX_FAILURE > 0:
+        print(
+            "Maximum failed articles limit for highest level news server: "
+            + str(MAX_FAILURE)
+            + "%"
+        )
+    return ArticleCheck(name, rar_msg_ids, failed_limit)
 
-            set_pp_parameters(nzb[0], PP_PARAMS_ON_SUCCESS)
-            unpause_nzb(nzb[0])  # unpause based on NZBGet ID
-        elif (
-            failed_ratio >= failed_limit
-            or (failed_ratio >= MAX_FAILURE and MAX_FAILURE > 0)
-        ) and nzb[2] < (int(time.time()) - int(AGE_LIMIT_SEC)):
-            success = False
 
-            set_pp_parameters(nzb[0], PP_PARAMS_ON_FAILURE)
+def decide_nzb_status(nzb, failed_limit, failed_ratio):
+    """
+    check if amount of failed articles is not too much. If too much keep
+    paused, if too old and too much failure mark bad / force failure,
+    otherwise resume. A failed_ratio of None, check time ran out, keeps the
+    nzb paused.
+    """
+    if failed_ratio is None:
+        print('[WARNING] "' + nzb[1] + '", remains paused for next check.')
+        return False
+    if VERBOSE:
+        print("[V] Total failed ratio: " + str(round(failed_ratio, 1)) + "%")
+    if (
+        failed_ratio < failed_limit
+        and (failed_ratio < MAX_FAILURE or MAX_FAILURE == 0)
+    ) or failed_ratio == 0:
+        success = True
+        print('Resuming: "' + nzb[1] + '"')
+        sys.stdout.flush()
+
+        set_pp_parameters(nzb[0], PP_PARAMS_ON_SUCCESS)
+        unpause_nzb(nzb[0])  # unpause based on NZBGet ID
+        del_nzb_plan(nzb[1])
+    elif (
+        failed_ratio >= failed_limit
+        or (failed_ratio >= MAX_FAILURE and MAX_FAILURE > 0)
+    ) and nzb[2] < (int(time.time()) - int(AGE_LIMIT_SEC)):
+        success = False
 
-            if VERBOSE:
-                if not FORCE_FAILURE:
-                    print('[V] Marked as BAD: "' + nzb[1] + '"')
-                    sys.stdout.flush()  # otherwise NZBGet sends message first
-            if FORCE_FAILURE:
-                force_failure(nzb[0])
-            else:
-                mark_bad(nzb[0])
+        set_pp_parameters(nzb[0], PP_PARAMS_ON_FAILURE)
+
+        if VERBOSE:
+            if not FORCE_FAILURE:
+                print('[V] Marked as BAD: "' + nzb[1] + '"')
+                sys.stdout.flush()  # otherwise NZBGet sends message first
+        if FORCE_FAILURE:
+            force_failure(nzb[0])
         else:
-            success = False
-            # dupekey should not be '', that would mean it is not added by RSS
-            if CHECK_DUPES != "no" and nzb[4] != "":
-                if get_dupe_nzb_status(nzb):
-                    print(
-                        '"'
-                        + nzb[1]
-                        + '" moved to history as DUPE, '
-                        + "complete DUPE returned to queue."
-                    )
-                else:
-                    print(
-                        '[WARNING] "'
-                        + nzb[1]
-                        + '", remains paused for next check, '
-                        + "no suitable/complete DUPEs found in history"
-                    )
-            elif CHECK_DUPES != "no" and nzb[4] == "" and VERBOSE:
+            mark_bad(nzb[0])
+        del_nzb_plan(nzb[1])
+    else:
+        success = False
+        # dupekey should not be '', that would mean it is not added by RSS
+        if CHECK_DUPES != "no" and nzb[4] != "":
+            if get_dupe_nzb_status(nzb):
+                print(
+                    '"'
+                    + nzb[1]
+                    + '" moved to history as DUPE, '
+                    + "complete DUPE returned to queue."
+                )
+            else:
                 print(
-                    "[V] "
+                    '[WARNING] "'
                     + nzb[1]
-                    + " is not added via RSS, therefore "
-                    + "the dupekey is empty and checking for DUPEs in the history "
-                    + "is skipped."
+                    + '", remains paused for next check, '
+                    + "no suitable/complete DUPEs found in history"
                 )
+        elif CHECK_DUPES != "no" and nzb[4] == "" and VERBOSE:
+            print(
+                "[V] "
+                + nzb[1]
+                + " is not added via RSS, therefore "
+                + "the dupekey is empty and checking for DUPEs in the history "
+                + "is skipped."
+            )
+    return success
+
+
+def get_nzb_status(nzb):
+    """
+    check the nzb and resume / keep paused / mark bad the nzb, see
+    decide_nzb_status(). NZBs that can't be checked are resumed.
+    """
+    if VERBOSE:
+        print("[V] get_nzb_status(nzb=" + str(nzb) + ")")
+    check = prepare_nzb_check(nzb)
+    if check is None:
+        success = True  # file send back to queue
+    else:
+        failed_ratio = get_known_ratio(check, nzb[2], nzb.first_post)
+        if failed_ratio is None:
+            failed_ratio = check_failure_status(
+                check.articles, check.failed_limit, nzb[2], nzb.first_post
+            )
+            save_check_result(check, failed_ratio)
+        success = decide_nzb_status(nzb, check.failed_limit, failed_ratio)
+    send_edits()  # apply the decision in NZBGet
+    return success
+
+
+def get_sweep_status(nzbs):
+    """
+    check the nzbs in a single pass, sharing the news server connections,
+    the nzbs get the connections in the order of the list. Each nzb is
+    resumed / kept paused / marked bad like in get_nzb_status(). Returns
+    True when one or more nzbs are resumed.
+    """
+    if VERBOSE:
+        print("[V] get_sweep_status(nzbs=" + str([nzb[0] for nzb in nzbs]) + ")")
+    success = False
+    checks = []
+    for nzb in nzbs:
+        check = prepare_nzb_check(nzb, os.path.basename(nzb[1]))
+        if check is None:
+            success = True  # file send back to queue
+            continue
+        checks.append((nzb, check, get_known_probe(check, nzb[2])))
+    # the confirm checks of the known failed ratios are done in the same pass
+    full_checks = []
+    if checks != []:
+        failed_ratios = check_articles(
+            [check if probe is None else probe[2] for (nzb, check, probe) in checks],
+            [nzb[2] for (nzb, check, probe) in checks],
+            [nzb.first_post for (nzb, check, probe) in checks],
+        )
+        for (nzb, check, probe), failed_ratio in zip(checks, failed_ratios):
+            if probe is None:
+                save_check_result(check, failed_ratio)
+            else:
+                failed_ratio = get_confirmed_ratio(check, probe, failed_ratio)
+                if failed_ratio is None:
+                    full_checks.append((nzb, check))
+                    continue
+            if decide_nzb_status(nzb, check.failed_limit, failed_ratio):
+                success = True
+    if full_checks != []:
+        # known failed ratios that are not confirmed
+        failed_ratios = check_articles(
+            [check for (nzb, check) in full_checks],
+            [nzb[2] for (nzb, check) in full_checks],
+            [nzb.first_post for (nzb, check) in full_checks],
+        )
+        for (nzb, check), failed_ratio in zip(full_checks, failed_ratios):
+            save_check_result(check, failed_ratio)
+            if decide_nzb_status(nzb, check.failed_limit, failed_ratio):
+                success = True
+    send_edits()  # apply the decisions in NZBGet
     return success
 
 
@@ -385,35 +818,27 @@ def get_dupe_nzb_status(nzb):
     """
     if VERBOSE:
         print("[V] get_dupe_nzb_status(nzb=" + str(nzb) + ")")
-    # get the data from the active history
-    data = call_nzbget_direct("history")
-    jobs = json.loads(data)
+    # DUPEs in the history, sorted on dupescore then on nzb age
+    jobs = get_history_index().get(nzb[4], [])
     duplicate = False
     num_duplicates = 0
-    list_duplicates = []
-    for job in jobs["result"]:
-        if (
-            job["Status"] == "DELETED/DUPE"
-            and job["DupeKey"] == nzb[4]
-            and "CnpNZBFileName" in str(job)
-        ):
-            if CHECK_DUPES == "yes":
-                duplicate = True
-                num_duplicates += 1
-                list_duplicates.append(job)
-            elif CHECK_DUPES == "SameScore" and job["DupeScore"] >= nzb[5]:
-                duplicate = True
-                num_duplicates += 1
-                list_duplicates.append(job)
-            else:
-                if VERBOSE:
-                    print(
-                        "[V] DUPE NZB found with lower dupe score, "
-                        + "ignored due to SameScore setting."
-                    )
+    sorted_duplicates = []
+    for job in jobs:
+        if CHECK_DUPES == "yes":
+            duplicate = True
+            num_duplicates += 1
+            sorted_duplicates.append(job)
+        elif CHECK_DUPES == "SameScore" and job.dupe_score >= nzb[5]:
+            duplicate = True
+            num_duplicates += 1
+            sorted_duplicates.append(job)
+        else:
+            if VERBOSE:
+                print(
+                    "[V] DUPE NZB found with lower dupe score, "
+                    + "ignored due to SameScore setting."
+                )
     if duplicate:
-        # sort on nzb age, then on dupescore. Higher score items will be on
-        # top. Oldest file has lowest maxposttime.
         if VERBOSE:
             print(
                 "[V] "
@@ -422,16 +847,14 @@ def get_dupe_nzb_status(nzb):
                 + nzb[1]
                 + " found in history"
             )
-        t = sorted(list_duplicates, key=itemgetter("MaxPostTime"))
-        sorted_duplicates = sorted(t, key=itemgetter("DupeScore"), reverse=True)
+        success = False
+        checks = []
         i = 0
-        # loop through all DUPE items (with optional matching DUPEscore)
+        # parse all DUPE items (with optional matching DUPEscore)
         for job in sorted_duplicates:
             i += 1
-            nzb_id = job["NZBID"]
-            nzb_filename = get_nzb_filename(job["Parameters"])
-            nzb_age = job["MaxPostTime"]  # nzb age
-            nzb_critical_health = job["CriticalHealth"]
+            nzb_id = job.nzb_id
+            nzb_filename = job.filename  # DUPE NZB, not the one in the queue
             print(
                 'Checking DUPE: "'
                 + nzb_filename
@@ -441,32 +864,52 @@ def get_dupe_nzb_status(nzb):
                 + str(num_duplicates)
                 + "]"
             )
-            rar_msg_ids = get_nzb_data(nzb[1])
+            rar_msg_ids = get_nzb_data(nzb_filename)
             if rar_msg_ids == -1:  # no such NZB file
-                success = False  # file marked BAD
                 if VERBOSE:
                     print("[WARNING] [V] No such DUPE NZB file, marking BAD.")
                 if FORCE_FAILURE:
                     force_failure_dupe(nzb_id)  #
                 else:
                     mark_bad_dupe(nzb_id)
+                drop_history_job(job)
             elif rar_msg_ids == -2:  # empty NZB or no group
-                success = False  # file marked BAD
                 if VERBOSE:
                     print("[WARNING] [V] DUPE NZB appears invalid, marking BAD.")
                 if FORCE_FAILURE:
                     force_failure_dupe(nzb_id)  #
                 else:
                     mark_bad_dupe(nzb_id)
+                drop_history_job(job)
+            elif rar_msg_ids == -3:  # no rar files
+                print("[WARNING] No rar files in DUPE NZB, skipping.")
             else:
-                failed_limit = get_max_failed_limit(nzb[3])
+                failed_limit = get_max_failed_limit(job.critical_health)
                 print("[V] Maximum failed articles limit: " + str(failed_limit) + "%")
-                failed_ratio = check_failure_status(rar_msg_ids, failed_limit, nzb[2])
+                name = os.path.basename(nzb_filename)
+                checks.append((job, ArticleCheck(name, rar_msg_ids, failed_limit)))
+        if checks != []:
+            # check all DUPEs at once, sharing the news server connections
+            failed_ratios = check_articles(
+                [check for (job, check) in checks],
+                [job.age for (job, check) in checks],
+                [job.first_post for (job, check) in checks],
+            )
+            # resume the best DUPE that is complete, the order is kept
+            for (job, check), failed_ratio in zip(checks, failed_ratios):
+                nzb_id = job.nzb_id
+                nzb_filename = job.filename
+                failed_limit = check.failed_limit
+                if failed_ratio is None:
+                    continue  # check time ran out, checked again later
                 if VERBOSE:
                     print(
-                        "[V] Total failed ratio: " + str(round(failed_ratio, 1)) + "%"
+                        "[V] "
+                        + check.prefix()
+                        + "Total failed ratio: "
+                        + str(round(failed_ratio, 1))
+                        + "%"
                     )
-
                 if (
                     failed_ratio < failed_limit
                     and (failed_ratio < MAX_FAILURE or MAX_FAILURE == 0)
@@ -475,24 +918,24 @@ def get_dupe_nzb_status(nzb):
                     print('Resuming DUPE: "' + nzb_filename + '"')
                     sys.stdout.flush()
                     unpause_nzb_dupe(nzb_id, nzb[0])  # resume on NZBGet ID
-                    break
+                    drop_history_job(job)
+                    del_nzb_plan(nzb_filename)
+                    break  # lower ranked DUPEs are left as they are
                 elif (
                     failed_ratio >= failed_limit
                     or (failed_ratio >= MAX_FAILURE and MAX_FAILURE > 0)
-                ) and nzb_age < (int(time.time()) - int(AGE_LIMIT_SEC)):
-                    success = False
+                ) and job.age < (int(time.time()) - int(AGE_LIMIT_SEC)):
                     if VERBOSE:
                         if not FORCE_FAILURE:
-                            print('[V] Marked as BAD: "' + nzb[1] + '"')
+                            print('[V] Marked as BAD: "' + nzb_filename + '"')
                         else:
-                            print('[V] Forcing failure of: "' + nzb[1] + '"')
+                            print('[V] Forcing failure of: "' + nzb_filename + '"')
                         sys.stdout.flush()
                     if FORCE_FAILURE:
                         force_failure_dupe(nzb_id)
                     else:
                         mark_bad_dupe(nzb_id)
-                else:
-                    success = False
+                    drop_history_job(job)
     else:
         if VERBOSE:
             print("[V] No DUPE of " + nzb[1] + " found in history.")
@@ -511,13 +954,11 @@ def is_number(s):
         return False
 
 
-def check_send_server_reply(
-    sock, reply: str, group: str, id, i, host, username, password
-):
+def check_send_server_reply(sock, reply: str, group: str, i, host, username, password):
     """
-    Check NNTP server messages, send data for next recv.
-    After connecting, there will be a 200 message, after each message, a
-    reply (t) will be send to get a next message.
+    Check NNTP server messages, send data for the NNTP server login.
+    After connecting, there will be a 200 message, the STAT requests are send
+    by check_server() as soon as the connection is ready for them.
 
     More info on NNTP server responses:
     The first digit of the response broadly indicates the success,
@@ -544,14 +985,12 @@ def check_send_server_reply(
             + reply
             + " ,group= "
             + str(group)
-            + " , id= "
-            + str(id)
             + " , i= "
             + str(i)
             + " )"
         )
     try:
-        id_used = False  # is id used via HEAD / STAT request to NNTP server
+        ready = False  # connection is ready for the next STAT request
         msg_id_used = None
         error = False
         server_reply = str(reply[:3])  # only first 3 chars are relevant
@@ -568,8 +1007,8 @@ def check_send_server_reply(
                 )
             server_reply = "NNTP reply incorrect."
             error = True  # pass these vars so that next article will be sent
-            id_used = True  # pass these vars so that next article will be sent
-            return (error, id_used, server_reply, msg_id_used)
+            ready = True  # pass these vars so that next article will be sent
+            return (error, ready, server_reply, msg_id_used)
         # checking NNTP server server_replies
         if server_reply in ("411", "420", "423", "430"):
             # 411 no such group
@@ -601,7 +1040,7 @@ def check_send_server_reply(
             sock.send(text.encode("utf-8"))
         elif server_reply in ("221"):
             # 221 article retrieved - head follows (reply on HEAD)
-            msg_id_used = reply.split()[2][1:-1]  # get msg id to identify ok article
+            msg_id_used = reply.split()[-1][1:-1]  # get msg id of ok article
             if EXTREME:
                 print(
                     "[E] Socket: "
@@ -613,7 +1052,7 @@ def check_send_server_reply(
                 )
         elif server_reply in ("223"):
             # 223 article retrieved - request text separately (reply on STAT)
-            msg_id_used = reply.split()[2][1:-1]  # get msg id to identify ok article
+            msg_id_used = reply.split()[-1][1:-1]  # get msg id of ok article
             if EXTREME:
                 print(
                     "[E] Socket: "
@@ -635,12 +1074,6 @@ def check_send_server_reply(
                     + ", NNTP reply: "
                     + str(reply.split())
                 )
-            text = CHECK_METHOD + " <" + id + ">\r\n"  # STAT is faster than HEAD
-            if EXTREME:
-                print(
-                    "[E] Socket: " + str(i) + " " + str(host) + ", Send: " + str(text)
-                )
-            sock.send(text.encode("utf-8"))
         elif server_reply in ("381"):  # 381 Password required
             text = "AUTHINFO PASS %s\r\n" % (password)
             if EXTREME:
@@ -725,7 +1158,6 @@ def check_send_server_reply(
                     + str(reply.split())
                 )
             error = True  # article is assumed to be not there
-            id_used = True
         else:
             if VERBOSE:
                 print(
@@ -736,9 +1168,10 @@ def check_send_server_reply(
                     + ", Not covered NNTP server reply code: "
                     + str(reply.split())
                 )
-        if VERBOSE or EXTREME:
-            sys.stdout.flush()
-        if end_loop == False and server_reply in (
+            error = True  # no valid reply on the request, assume not there
+        ready = server_reply in (
+            "200",
+            "201",
             "211",
             "221",
             "223",
@@ -747,25 +1180,11 @@ def check_send_server_reply(
             "420",
             "423",
             "430",
-        ):
-            # Send next message
-            text = CHECK_METHOD + " <" + id + ">\r\n"  # STAT is faster than HEAD
-            id_used = True
-            if EXTREME:
-                print(
-                    "[E] Socket: " + str(i) + " " + str(host) + ", Send: " + str(text)
-                )
-            sock.send(text.encode("utf-8"))
-        elif end_loop and server_reply not in ("205"):
-            text = "QUIT\r\n"
-            sock.send(text.encode("utf-8"))
-            if EXTREME:
-                print(
-                    "[E] Socket: " + str(i) + " " + str(host) + ", Send: " + str(text)
-                )
+            "999",
+        ) or error
         if VERBOSE or EXTREME:
             sys.stdout.flush()
-        return (error, id_used, server_reply, msg_id_used)
+        return (error, ready, server_reply, msg_id_used)
     except:
         print(
             "Exception LINE: "
@@ -776,94 +1195,251 @@ def check_send_server_reply(
         return (False, False, server_reply, -1)
 
 
-def fix_nzb(nzb_lines):
+def open_nzb(fname):
     """
-    some nzbs may contain all data on 1 single line, to handle this
-    correctly in check_nzb(), the single line is splitted on the >< mark
+    open the NZB file for reading as text. gzip, bz2 and zstd compressed
+    NZB files are detected on their magic bytes, and decompressed while
+    reading, without writing the inflated NZB to disk.
+    """
+    with open(fname, "rb") as fd:
+        magic = fd.read(4)
+    if magic[:2] == b"\x1f\x8b":
+        if VERBOSE:
+            print("[V] Reading gzip compressed NZB file.")
+        return gzip.open(fname, mode="rt", encoding="utf-8")
+    if magic[:3] == b"BZh":
+        if VERBOSE:
+            print("[V] Reading bz2 compressed NZB file.")
+        return bz2.open(fname, mode="rt", encoding="utf-8")
+    if magic == b"\x28\xb5\x2f\xfd":
+        if zstd is None:
+            print(
+                "[ERROR] NZB file is zstd compressed, install the zstandard "
+                + "python package to read it."
+            )
+            return None
+        if VERBOSE:
+            print("[V] Reading zstd compressed NZB file.")
+        return io.TextIOWrapper(zstd.open(fname, "rb"), encoding="utf-8")
+    return open(fname, encoding="utf-8")
+
+
+def iter_nzb_lines(fd):
+    """
+    read the NZB data in chunks and yield it line by line. Some nzbs may
+    contain all data on 1 single line, to handle this correctly in
+    parse_nzb(), lines are also splitted on the >< mark.
+    """
+    rest = ""
+    while True:
+        data = fd.read(NZB_READ_CHUNK)
+        if not data:
+            break
+        lines = (rest + data).replace("><", ">\n<").split("\n")
+        rest = lines.pop()  # incomplete line, completed by next chunk
+        yield from lines
+    if rest:
+        yield rest
+
+
+class ArticleTable:
+    """
+    Columnar store of the articles of a NZB file. Subject and groups are
+    stored once per file, the message-ids in a flat list, and the check
+    result of each article in a bytearray: 0 = no check / failed, 1,2,.. ok
+    for server num.
+    """
+
+    __slots__ = ("files", "file_rows", "msg_ids", "status")
+
+    def __init__(self, files=None):
+        self.files = files if files is not None else []  # (subject, groups)
+        self.file_rows = array("I")  # row in files for each article
+        self.msg_ids = []
+        self.status = bytearray()
+
+    def __len__(self):
+        return len(self.msg_ids)
+
+    def __repr__(self):
+        return "ArticleTable(files=%d, articles=%d, ok=%d)" % (
+            len(self.files),
+            len(self.msg_ids),
+            len(self.status) - self.status.count(0),
+        )
+
+    def add_file(self, subject, groups):
+        self.files.append((subject, groups))
+
+    def add_article(self, message_id):
+        self.file_rows.append(len(self.files) - 1)
+        self.msg_ids.append(message_id)
+        self.status.append(0)
+
+    def groups(self, i):
+        return self.files[self.file_rows[i]][1]
+
+    def sample(self, each, unescape=True):
+        """
+        new table with each Xth article, sharing the file table. The
+        message-ids are unescaped, so they can be used on the NNTP server.
+        """
+        t = ArticleTable(self.files)
+        t.file_rows = self.file_rows[::each]
+        if unescape:
+            t.msg_ids = [html.unescape(m) for m in self.msg_ids[::each]]
+        else:
+            t.msg_ids = self.msg_ids[::each]
+        t.status = bytearray(len(t.msg_ids))
+        return t
+
+    def subset(self, rows):
+        """
+        new table with the articles of rows, sharing the file table.
+        """
+        t = ArticleTable(self.files)
+        for row in rows:
+            t.file_rows.append(self.file_rows[row])
+            t.msg_ids.append(self.msg_ids[row])
+        t.status = bytearray(len(t.msg_ids))
+        return t
+
+    def content_hash(self):
+        """
+        hash of the number of articles and about 64 of the message-ids, the
+        same NZB added again under an other name has the same hash.
+        """
+        each = max(1, len(self.msg_ids) // 64)
+        h = hashlib.sha1(str(len(self.msg_ids)).encode("utf-8"))
+        for m in self.msg_ids[::each]:
+            h.update(m.encode("utf-8", "replace"))
+        return h.hexdigest()
+
+    def to_dict(self):
+        return {
+            "files": self.files,
+            "file_rows": self.file_rows.tolist(),
+            "msg_ids": self.msg_ids,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        cache = {}
+        t = cls([(f[0], intern_groups(f[1], cache)) for f in data["files"]])
+        t.file_rows = array("I", data["file_rows"])
+        t.msg_ids = data["msg_ids"]
+        t.status = bytearray(len(t.msg_ids))
+        return t
+
+
+def intern_groups(groups, cache):
+    """
+    return a shared tuple for the list of groups, most files in a NZB are
+    posted to the same groups.
+    """
+    key = tuple(groups)
+    t = cache.get(key)
+    if t is None:
+        t = tuple(sys.intern(g) for g in key)
+        cache[key] = t
+    return t
+
+
+def get_nzb_data(fname):
+    """
+    return data set of articles to be checked for the NZB file, using the
+    check plan prepared by scan_call() when it is still valid, otherwise
+    the NZB file is parsed.
     """
     if VERBOSE:
-        print("[V] fix_nzb(nzb_lines=" + str(nzb_lines) + ")")
-        print("[V] Splitting NZB data into separate lines.")
-        sys.stdout.flush()
-    nzb_lines = str(nzb_lines)
-    positions = [n for n in range(len(nzb_lines)) if nzb_lines.find("><", n) == n]
-    first = 0
-    last = 0
-    corrected_lines = []
-    for n in positions:
-        last = n + 1
-        corrected_lines.append(nzb_lines[first:last])
-        first = last
-    if VERBOSE:
-        print("[V] Data in NZB splitted into separate lines.")
+        print("[V] get_nzb_data(fname=" + str(fname) + ")")
         sys.stdout.flush()
-    return corrected_lines
+    if not os.path.isfile(fname):
+        print("[ERROR] No such nzb file.")
+        return -1
+    rar_msg_ids = load_nzb_plan(fname)
+    if rar_msg_ids is not None:
+        if VERBOSE:
+            print("[V] Using check plan prepared when the NZB was added.")
+        return rar_msg_ids
+    rar_msg_ids = parse_nzb(fname)
+    save_nzb_plan(fname, fname, rar_msg_ids)
+    return rar_msg_ids
 
 
-def get_nzb_data(fname):
+def parse_nzb(fname):
     """
     extract the nzb info from the NZB file, and return data set of articles
     to be checked
     """
     if VERBOSE:
-        print("[V] get_nzb_data(fname=" + str(fname) + ")")
+        print("[V] parse_nzb(fname=" + str(fname) + ")")
         sys.stdout.flush()
     if os.path.isfile(fname):
         file_exists = True
-        fd = open(fname, encoding="utf-8")
-        lines = fd.readlines()
-        fd.close()
-        if len(lines) == 1:  # single line NZB
-            lines = fix_nzb(lines)
+        fd = open_nzb(fname)
+        if fd is None:
+            return -2
     else:
         file_exists = False
         print("[ERROR] No such nzb file.")
         return -1
     if file_exists:
-        all_msg_ids = []  # list of message ids for NNTP server
+        rar_msg_ids = ArticleTable()  # message ids for NNTP server
         group = None
         groups = None
+        group_cache = {}
         subject = ""
         par = 0
-        for line in lines:
-            low_line = line.lower()
-            if "<segment bytes" in low_line:  # msg id
-                message_id = line.split(">")[1].split("<")[0]
-                ok = -1  # = no check / failed; 1,2,.. ok for server num
-                all_msg_ids.append([subject, par, groups, message_id, ok])
-            elif "<file" in low_line and "subject=" in low_line:  # look for par2 files
-                subject = line.split("subject=")[1].split(">")[0]
-                if ".par2" in low_line:
-                    par = 1  # found a par file, next msg_ids of par2s
-                else:
-                    par = 0  # not a par file, next msg ids of files
-            elif "<groups>" in low_line:  # set of groups
-                # new list of groups found
-                groups = []
-            elif "<group>" in low_line:  # group name
-                group = line.split(">")[1].split("<")[0]
-                groups.append(group)
+        file_groups = False  # groups of current file stored in table
+        all_articles = 0
+        par_articles = 0
+        try:
+            for line in iter_nzb_lines(fd):
+                low_line = line.lower()
+                if "<segment bytes" in low_line:  # msg id
+                    all_articles += 1
+                    if par == 1:
+                        # only the amount of par2 articles is used
+                        par_articles += 1
+                        continue
+                    if not file_groups:
+                        rar_msg_ids.add_file(
+                            subject, intern_groups(groups or [], group_cache)
+                        )
+                        file_groups = True
+                    message_id = line.split(">")[1].split("<")[0]
+                    rar_msg_ids.add_article(message_id)
+                elif "<file" in low_line and "subject=" in low_line:  # look for par2 files
+                    subject = line.split("subject=")[1].split(">")[0]
+                    file_groups = False
+                    if ".par2" in low_line:
+                        par = 1  # found a par file, next msg_ids of par2s
+                    else:
+                        par = 0  # not a par file, next msg ids of files
+                elif "<groups>" in low_line:  # set of groups
+                    # new list of groups found
+                    groups = []
+                elif "<group>" in low_line:  # group name
+                    group = line.split(">")[1].split("<")[0]
+                    groups.append(group)
+        except NZB_READ_ERRORS as e:
+            print("[ERROR] Failed to read NZB file: " + str(e))
+            return -2
+        finally:
+            fd.close()
     if not group:
         print("[ERROR] No group found in NZB file.")
         if VERBOSE:
             print("[V] group: " + str(group))
         return -2
-    if len(all_msg_ids) == 0:
+    if all_articles == 0:
         print("[ERROR] No message-ids found in NZB file")
         if VERBOSE:
-            print("[V] all_msg_ids: " + str(all_msg_ids))
+            print("[V] all_articles: " + str(all_articles))
         return -2
-    rar_msg_ids = []
-    par_msg_ids = []
-    for msg_id in all_msg_ids:  # split par2 from other files
-        if msg_id[1] == 0:
-            rar_msg_ids.append(msg_id)
-        else:
-            par_msg_ids.append(msg_id)
-    all_articles = len(all_msg_ids)
     rar_articles = len(rar_msg_ids)
-    par_articles = len(par_msg_ids)
-    temp = len(rar_msg_ids)
+    temp = rar_articles
     if temp == 0:
         # No .rar articles in NZB.
         return -3
@@ -897,11 +1473,8 @@ def get_nzb_data(fname):
                     + str(MIN_ARTICLES)
                     + " articles."
                 )
-    t = rar_msg_ids[::each]
-    rar_msg_ids = t
     # parsing to be used ids, skipping subject parsing
-    for i, rar_msg_id in enumerate(rar_msg_ids):
-        rar_msg_ids[i][3] = html.unescape(rar_msg_id[3])
+    rar_msg_ids = rar_msg_ids.sample(each)
     articles_to_check = len(rar_msg_ids)
     if VERBOSE:
         print(
@@ -918,21 +1491,328 @@ def get_nzb_data(fname):
     return rar_msg_ids
 
 
-def get_server_settings(nzb_age):
+def get_tmp_path(*names):
     """
-    Get the settings for all the active news-servers in NZBGet, and store
-    them in a list. Filter out all but 1 server in same group.
+    Path in the completion dir in the NZBGet TempDir, the (sub)dir is
+    created when missing.
+    """
+    tmp_path = os.path.join(os.environ["NZBOP_TEMPDIR"], "completion", *names)
+    try:
+        os.makedirs(tmp_path)
+    except OSError as exc:
+        if exc.errno == errno.EEXIST and os.path.isdir(tmp_path):
+            pass
+        else:
+            raise
+    return tmp_path
+
+
+def get_plan_file(fname):
+    """
+    Path of the check plan of a (queued) NZB file, queued files are
+    matched on their file name only, the NZB dir may be reported in a
+    different form in the scan and queue / scheduler calls.
+    """
+    return os.path.join(get_tmp_path("plans"), os.path.basename(fname) + ".json")
+
+
+def get_plan_settings():
+    """
+    Script settings that change the check plan of a NZB.
+    """
+    return [CHECK_LIMIT, MAX_ARTICLES, MIN_ARTICLES, FULL_CHECK_NO_PARS]
+
+
+def save_nzb_plan(fname, source, rar_msg_ids):
+    """
+    Store the articles to be checked (or the error code of parse_nzb()) for
+    NZB file fname, parsed from file source. The queue / scheduler calls
+    can then skip parsing while NZBGet downloading is paused.
+    """
+    try:
+        plan = {
+            "size": os.path.getsize(source),
+            "settings": get_plan_settings(),
+        }
+        if isinstance(rar_msg_ids, ArticleTable):
+            plan["articles"] = rar_msg_ids.to_dict()
+        else:
+            plan["result"] = rar_msg_ids
+        f_name = get_plan_file(fname)
+        with open(f_name + ".tmp", encoding="utf-8", mode="w") as fd:
+            json.dump(plan, fd)
+        os.replace(f_name + ".tmp", f_name)
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Failed to store check plan for {fname}: {e}")
+
+
+def load_nzb_plan(fname):
+    """
+    Return the stored check plan for NZB file fname, None when there is no
+    plan, or when the NZB file or script settings changed after storing it.
+    """
+    f_name = get_plan_file(fname)
+    try:
+        with open(f_name, encoding="utf-8") as fd:
+            plan = json.load(fd)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Ignoring unreadable check plan {f_name}: {e}")
+        return None
+    try:
+        if (
+            plan["size"] != os.path.getsize(fname)
+            or plan["settings"] != get_plan_settings()
+        ):
+            if VERBOSE:
+                print("[V] Stored check plan is outdated, parsing NZB file.")
+            return None
+        if "result" in plan:
+            return plan["result"]
+        return ArticleTable.from_dict(plan["articles"])
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        print(f"[WARNING] Ignoring invalid check plan {f_name}: {e}")
+        return None
+
+
+def del_nzb_plan(fname):
+    """
+    Delete the check plan of a NZB that won't be checked again.
+    """
+    try:
+        os.remove(get_plan_file(fname))
+    except OSError:
+        pass
+
+
+def get_result_cache():
+    """
+    Results of the checks of the last RESULT_CACHE_TTL_SEC, by content hash
+    of the articles: [check time, failed ratio]. Stored in
+    completion/results.json.
+    """
+    global result_cache
+    if result_cache is None:
+        try:
+            with open(os.path.join(get_tmp_path(), "results.json")) as fd:
+                result_cache = json.load(fd)
+        except (OSError, ValueError):
+            result_cache = {}
+        max_age = time.time() - RESULT_CACHE_TTL_SEC
+        for key in [k for k, v in result_cache.items() if v[0] < max_age]:
+            del result_cache[key]
+    return result_cache
+
+
+def save_check_result(check, failed_ratio):
+    if failed_ratio is None:
+        return  # no result, checked again later
+    get_result_cache()[check.articles.content_hash()] = [time.time(), failed_ratio]
+    f_name = os.path.join(get_tmp_path(), "results.json")
+    try:
+        with open(f_name + ".tmp", encoding="utf-8", mode="w") as fd:
+            json.dump(result_cache, fd)
+        os.replace(f_name + ".tmp", f_name)
+    except OSError as e:
+        print("[WARNING] Check results not saved: " + str(e))
+
+
+def get_cached_probe(check):
+    """
+    failed_ratio of the same NZB checked before as complete, with a check
+    of RESULT_CONFIRM_ARTICLES of its articles to confirm it. None when the
+    NZB is not checked before.
+    """
+    result = get_result_cache().get(check.articles.content_hash())
+    if result is None or result[1] >= check.failed_limit:
+        return None
+    print(
+        check.prefix()
+        + "Same NZB checked "
+        + str(round((time.time() - result[0]) / 3600.0, 1))
+        + " hours ago, failed ratio: "
+        + str(round(result[1], 1))
+        + "%, confirming with a sample of the articles."
+    )
+    each = -(-len(check.articles) // RESULT_CONFIRM_ARTICLES)  # round up
+    sample = check.articles.sample(each, unescape=False)
+    return ("cache", result[1], ArticleCheck(check.name, sample, check.failed_limit))
+
+
+def get_msg_hash(msg_id):
+    return int.from_bytes(
+        hashlib.blake2b(msg_id.encode("utf-8", "replace"), digest_size=8).digest(),
+        "little",
+    )
+
+
+def get_takedowns():
     """
+    64 bit hashes of the message ids missing on all news servers of NZBs
+    that failed after AgeLimit, stored in completion/takedowns.bin in the
+    order they are added. With TAKEDOWN_MAX hashes the chance that an
+    other message id has a known hash is below 1e-14.
+    """
+    global takedown_log, takedown_hashes
+    if takedown_log is None:
+        takedown_log = array("Q")
+        try:
+            with open(os.path.join(get_tmp_path(), "takedowns.bin"), "rb") as fd:
+                takedown_log.frombytes(fd.read())
+        except (OSError, ValueError):
+            takedown_log = array("Q")
+        takedown_hashes = array("Q", sorted(takedown_log))
+    return takedown_hashes
+
+
+def is_takedown(msg_id):
+    hashes = get_takedowns()
+    h = get_msg_hash(msg_id)
+    i = bisect.bisect_left(hashes, h)
+    return i < len(hashes) and hashes[i] == h
+
+
+def update_takedowns(add_ids=(), remove_ids=()):
+    """
+    add / remove message ids of the known takedowns, the oldest are
+    dropped above TAKEDOWN_MAX.
+    """
+    global takedown_log, takedown_hashes
+    get_takedowns()
+    add = set(get_msg_hash(m) for m in add_ids if not is_takedown(m))
+    remove = set(get_msg_hash(m) for m in remove_ids if is_takedown(m))
+    if not add and not remove:
+        return
+    if remove:
+        takedown_log = array("Q", (h for h in takedown_log if h not in remove))
+    takedown_log.extend(sorted(add))
+    if len(takedown_log) > TAKEDOWN_MAX:
+        del takedown_log[: len(takedown_log) - TAKEDOWN_MAX]
+    takedown_hashes = array("Q", sorted(takedown_log))
     if VERBOSE:
-        print("[V] get_server_settings(nzb_age=" + str(nzb_age) + ")")
-    # get news server settings for each server
-    NZBGet = connect_to_nzbget()
-    nzbget_status = NZBGet.status()
-    servers_status = nzbget_status["NewsServers"]
+        print(
+            "[V] Known takedowns: "
+            + str(len(add))
+            + " added, "
+            + str(len(remove))
+            + " removed, "
+            + str(len(takedown_log))
+            + " in total."
+        )
+    f_name = os.path.join(get_tmp_path(), "takedowns.bin")
+    try:
+        with open(f_name + ".tmp", mode="wb") as fd:
+            fd.write(takedown_log.tobytes())
+        os.replace(f_name + ".tmp", f_name)
+    except OSError as e:
+        print("[WARNING] Known takedowns not saved: " + str(e))
+
+
+def get_takedown_probe(check, nzb_age):
+    """
+    failed_ratio of a NZB older than AgeLimit, from its articles that are
+    known takedowns, with a check of a few of them to confirm that they are
+    still missing on all news servers. Only used when the known takedowns
+    alone reach the failed limit. None when the NZB needs a full check.
+    """
+    if nzb_age > time.time() - AGE_LIMIT_SEC:
+        return None
+    articles = check.articles
+    known = [row for row in range(len(articles)) if is_takedown(articles.msg_ids[row])]
+    failed_ratio = len(known) * 100.0 / len(articles)
+    if failed_ratio < check.failed_limit:
+        return None
+    print(
+        check.prefix()
+        + str(len(known))
+        + " of "
+        + str(len(articles))
+        + " articles are known takedowns, confirming with a few of them."
+    )
+    each = max(1, len(known) // TAKEDOWN_CONFIRM_ARTICLES)
+    sample = articles.subset(known[::each][:TAKEDOWN_CONFIRM_ARTICLES])
+    # failed limit of 100%, check the sample on all news servers
+    return ("takedown", failed_ratio, ArticleCheck(check.name, sample, 100))
+
+
+def get_known_probe(check, nzb_age):
+    """
+    Probe of the failed_ratio known without a full check, from the known
+    takedowns or the result of the same NZB checked before: (kind,
+    failed_ratio, confirm check). The confirm check is done by
+    check_articles(), see get_confirmed_ratio(). None when the NZB needs a
+    full check.
+    """
+    probe = get_takedown_probe(check, nzb_age)
+    if probe is None:
+        probe = get_cached_probe(check)
+    return probe
+
+
+def get_confirmed_ratio(check, probe, confirm_ratio):
+    """
+    failed_ratio of the probe when its confirm check agrees. Takedowns that
+    are found are removed from the known takedowns, a sample with more
+    failed articles than expected from the earlier failed ratio is not
+    complete. None when the NZB needs a full check.
+    """
+    (kind, failed_ratio, confirm) = probe
+    sample = confirm.articles
+    if kind == "takedown":
+        if confirm_ratio != 100:
+            found = [
+                sample.msg_ids[row] for row in range(len(sample)) if sample.status[row]
+            ]
+            update_takedowns(remove_ids=found)
+            print(check.prefix() + "Takedowns not confirmed, checking all articles.")
+            return None
+    elif (
+        confirm_ratio is None
+        or confirm.failed_articles > -(-failed_ratio * len(sample) // 100)
+    ):
+        print(check.prefix() + "Sample not complete, checking all articles.")
+        return None
+    return failed_ratio
+
+
+def get_known_ratio(check, nzb_age, first_post=None):
+    """
+    failed_ratio without a full check, see get_known_probe(). None when the
+    NZB needs a full check.
+    """
+    probe = get_known_probe(check, nzb_age)
+    if probe is None:
+        return None
+    confirm_ratio = check_articles([probe[2]], [nzb_age], [first_post])[0]
+    return get_confirmed_ratio(check, probe, confirm_ratio)
+
+
+def prune_nzb_plans():
+    """
+    Delete check plans of NZBs removed from NZBGet before a final check.
+    """
+    plan_dir = get_tmp_path("plans")
+    max_age = time.time() - PLAN_MAX_AGE_SEC
+    for f_name in os.listdir(plan_dir):
+        try:
+            if os.path.getmtime(os.path.join(plan_dir, f_name)) < max_age:
+                os.remove(os.path.join(plan_dir, f_name))
+        except OSError:
+            continue
+
+
+def get_server_table():
+    """
+    Get the settings for all the news-servers in NZBGet from the status and
+    environment, once per run.
+    """
+    global server_table
+    if server_table is not None:
+        return server_table
+    status = nzbget_status()
+    servers_status = status["NewsServers"]
     temp = []
-    servers = []
-    i = 0
-    skip = False
     for server_status in servers_status:
         # extract all relevant data for each server:
         s = str(server_status["ID"])  # 9
@@ -963,9 +1843,28 @@ def get_server_settings(nzb_age):
                 active,
             ]
         )
+    server_table = temp
+    return server_table
+
+
+def get_server_settings(nzb_age, broken=None):
+    """
+    Get the settings for all the active news-servers in NZBGet, and store
+    them in a list. Filter out all but 1 server in same group, or keep them
+    as its mirrors with GroupMirrors. The broken list, when given, gets the
+    servers the NZB would use that are skipped by their circuit breaker.
+    """
+    if VERBOSE:
+        print("[V] get_server_settings(nzb_age=" + str(nzb_age) + ")")
+    # get news server settings for each server
+    temp = get_server_table()
+    servers = []
+    broken_servers = []
+    skip = False
     nzb_age_days = (int(time.time()) - nzb_age) / 3600.0 / 24.0
     for server in temp:
         skip = False
+        skip_breaker = False
         retention = float(server[8])
         # Active or not
         if server[10] == False:
@@ -1004,9 +1903,21 @@ def get_server_settings(nzb_age):
                     + str(AGE_LIMIT)
                     + " hours"
                 )
+        # Server failed in earlier checks
+        elif breaker_open(server):
+            skip = True
+            skip_breaker = True
+            if VERBOSE:
+                print(
+                    "[V] Skipping server: "
+                    + server[2]
+                    + ", failed in earlier checks, "
+                    + "waiting for the circuit breaker cooldown."
+                )
         # Server retention lower than nzb age
         if retention < nzb_age_days and retention != 0:
             skip = True
+            skip_breaker = False
             if VERBOSE:
                 print(
                     "[V] Skipping server: "
@@ -1020,6 +1931,8 @@ def get_server_settings(nzb_age):
         # removing all to be skipped servers
         if skip == False:
             servers.append(server)
+        elif skip_breaker:
+            broken_servers.append(server)
     if VERBOSE:
         print(
             "[V] All news servers after filtering on Active, Servers, "
@@ -1037,17 +1950,26 @@ def get_server_settings(nzb_age):
                 + ", connections: "
                 + str(server[7])
             )
+    if broken is not None:
+        # an other server of the same group replaces a broken server
+        groups = set(int(server[1]) for server in servers) - {0}
+        broken.extend(
+            server for server in broken_servers if int(server[1]) not in groups
+        )
     # sort on groups, followed by lvl, so that all identical group numbers > 0
     # can be removed
     servers.sort(key=itemgetter(1, 0))
     a = None
     c = []
-    # remove all identical groups from server:
+    # remove all identical groups from server, with GroupMirrors the removed
+    # servers are used as mirrors (server[11]) of the remaining one
     for server in servers:
         b = int(server[1])
         # only allow 1 server per group
         if a != b:
-            c.append(server)
+            c.append(server[:11] + [[]])
+        elif GROUP_MIRRORS:
+            c[-1][11].append(server)
         # guarantee that all group 0 (no group) servers remain
         if b > 0:
             a = b
@@ -1068,6 +1990,16 @@ def get_server_settings(nzb_age):
                 + ", connections: "
                 + str(server[7])
             )
+            for mirror in server[11]:
+                print(
+                    "[V]   + "
+                    + str(mirror[2])
+                    + ":"
+                    + str(mirror[3])
+                    + ", connections: "
+                    + str(mirror[7])
+                    + ", same group"
+                )
     if servers == []:
         print(
             "[WARNING] No news servers after filtering, marking NZB as"
@@ -1076,11 +2008,12 @@ def get_server_settings(nzb_age):
     return servers
 
 
-def create_sockets(server, articles_to_check):
+def create_sockets(server, articles_to_check, num_conn=None):
     """
-    create the sockets for the server that will be used to send in
-    check_send_server_reply() and receive in check_failure_status()
+    create the sockets for the server that will be used to send and receive
+    in check_server()
     server dependent sockets, ssl / non ssl
+    num_conn overrides the number of connections of the server settings
     """
     if EXTREME:
         print(
@@ -1095,7 +2028,8 @@ def create_sockets(server, articles_to_check):
     host = server[2]
     port = int(server[3])
     encryption = server[6]  # ssl
-    num_conn = int(server[7])
+    if num_conn is None:
+        num_conn = int(server[7])
     start_sock = 0
     end_sock = num_conn
     if end_sock >= articles_to_check:
@@ -1216,485 +2150,1275 @@ def create_sockets(server, articles_to_check):
     return (sockets, failed_sockets, conn_err)
 
 
-def check_failure_status(rar_msg_ids, failed_limit, nzb_age):
+class ArticleCheck:
     """
-    Get the failed_ratio for each news server, if nth server failed_ratio
-    below failed_limit, return ok failure ratio for resuming
+    Check of the articles of a single NZB by check_articles(), with the
+    failed articles on the news server that is used at the moment.
     """
-    if EXTREME:
-        print(
-            "[E] check_failure_status(rar_msg_ids="
-            + str(rar_msg_ids)
-            + ", failed_limit="
-            + str(failed_limit)
-            + ")"
+
+    __slots__ = (
+        "name",
+        "articles",
+        "failed_limit",
+        "failed_ratio",
+        "failed_articles",
+        "send_articles",
+        "message_on",
+        "done",
+        "bucket",
+        "age",
+        "first_post",
+        "answered",
+        "start",
+        "deadline",
+        "timed_out",
+        "broken",
+    )
+
+    def __init__(self, name, articles, failed_limit):
+        self.name = name  # None for a single NZB, printed otherwise
+        self.articles = articles
+        self.failed_limit = failed_limit
+        self.failed_ratio = 0
+        self.failed_articles = 0
+        self.send_articles = 0
+        self.done = False  # no check on the next news servers needed
+        self.bucket = None  # post age bucket, for the server stats
+        self.age = None  # post time of the NZB, for the overview probe
+        self.first_post = None  # post time of the first article of the NZB
+        self.answered = 0  # articles with a result on the current server
+        self.start = None  # time of the first request of the NZB
+        self.deadline = None  # end of the check time, see get_check_deadline()
+        self.timed_out = False  # check time ran out before a result
+        self.broken = False  # a news server of the NZB failed, see breakers
+        articles_to_check = len(articles)
+        # message on each 25 %
+        self.message_on = [
+            1,
+            int(articles_to_check * failed_limit * 0.01),
+            int(articles_to_check * 0.25),
+            int(articles_to_check * 0.50),
+            int(articles_to_check * 0.75),
+            int(articles_to_check),
+        ]
+
+    def prefix(self):
+        return "" if self.name is None else '"' + self.name + '": '
+
+    def keep_checking(self):
+        """
+        Continue sending articles, till the failed_ratio exceeds both the
+        failed_limit and the MaxFailure of the news server.
+        """
+        return (
+            self.failed_ratio < self.failed_limit
+            or self.failed_ratio < MAX_FAILURE
+            or self.failed_ratio == 0
         )
-    articles_to_check = len(rar_msg_ids)
-    # message on each 25 %
-    message_on = [
-        1,
-        int(articles_to_check * failed_limit * 0.01),
-        int(articles_to_check * 0.25),
-        int(articles_to_check * 0.50),
-        int(articles_to_check * 0.75),
-        int(articles_to_check),
-    ]
-    servers = get_server_settings(nzb_age)  # get news server provider settings
-    if servers == []:
-        return 100
-    num_server = 0
-    global end_loop
-    # looping through servers, until limited failure
-    failed_ratio = 0
-    for server in servers:
-        if failed_ratio > MAX_FAILURE and MAX_FAILURE != 0:
-            print("[WARNING] failure ratio > MaxFailure.")
-            break
-        host = server[2]
-        username = server[4]
-        password = server[5]
-        num_conn = int(server[7])
-        start_sock = 0
-        end_sock = num_conn
-        if end_sock >= articles_to_check:
-            # avoiding making more sockets than headers that need to be checked.
-            num_conn = int(articles_to_check / 2.0 + 0.5)
-            end_sock = num_conn
-        failed_articles = 0
-        send_articles = 0
-        end_loop = False
-        socket_loop_count = [-1] * num_conn
-        failed_wait_count = 0
-        loop_fail = False
-        chunk = 4096
-        start_time = time.time()
-        print("Using server: " + host)
-        sys.stdout.flush()
-        # build the (non) ssl sockets per server
-        (sockets, failed_sockets, conn_err) = create_sockets(server, articles_to_check)
-        if conn_err >= num_conn:
-            print("[WARNING] Skipping server: " + host)
-            num_server += 1
-            failed_ratio = 100
-            continue
-        failed_ratio = 0
-        num_server += 1
-        # filtering failed sockets
-        socket_list = []
-        for i in range(start_sock, end_sock):
-            if len(failed_sockets) > 0:
-                if i not in failed_sockets:
-                    socket_list.append(i)
-            else:
-                socket_list.append(i)
-        num_conn = len(socket_list)
-        # loop through all rar_msg_ids, check each one if available
-        # if to much failed for server, skip check and move to next
-        # send_articles has range 0 to x-1, while articles to check = x
-        while (
-            send_articles <= articles_to_check - 1
-            and (failed_ratio < failed_limit or failed_ratio == 0)
-            or send_articles <= articles_to_check - 1
-            and (failed_ratio < MAX_FAILURE or failed_ratio == 0)
-        ):
-            # check each connection for data receive
-            if loop_fail:  # exit while loop after looping
-                failed_ratio = 100
+
+    def count_send(self):
+        if self.start is None:
+            # the check time of the NZB starts with its first request
+            self.start = time.time()
+            self.deadline = get_check_deadline()
+        self.send_articles += 1
+        if self.send_articles in self.message_on:
+            print(
+                self.prefix()
+                + "Requested ["
+                + str(self.send_articles)
+                + "/"
+                + str(len(self.articles))
+                + "] articles, "
+                + str(self.failed_articles)
+                + " failed."
+            )
+            sys.stdout.flush()
+
+    def count_failed(self):
+        self.failed_articles += 1
+        self.failed_ratio = self.failed_articles * 100.0 / len(self.articles)
+
+    def out_of_time(self):
+        return self.deadline is not None and time.time() > self.deadline
+
+    def estimate(self):
+        """
+        Failed ratio of the articles with a result on the current server,
+        and the upper bound of the 95% (Wilson) interval of that ratio.
+        """
+        n = self.answered
+        if n == 0:
+            return (0, 100)
+        p = self.failed_articles / n
+        z = 1.96
+        upper = (
+            p + z * z / (2 * n) + z * ((p * (1 - p) + z * z / (4 * n)) / n) ** 0.5
+        ) / (1 + z * z / n)
+        return (p * 100, min(upper * 100, 100))
+
+
+class NntpConnection:
+    """
+    Connection i to a news server, with the reply data received so far and
+    the (check, row) of the article requested on it.
+    """
+
+    __slots__ = (
+        "i",
+        "sock",
+        "server",
+        "login",
+        "buffer",
+        "pending",
+        "ready",
+        "wait_start",
+        "reconnects",
+        "discard",
+    )
+
+    def __init__(self, i, sock, server):
+        self.i = i
+        self.sock = sock
+        self.server = server
+        self.login = (server[2], server[4], server[5])  # host, username, password
+        self.buffer = b""
+        self.pending = None
+        self.ready = False  # waiting for the 200 welcome message
+        self.wait_start = time.time()
+        self.reconnects = 0  # times the connection is replaced by a new one
+        self.discard = 0  # late replies to ignore, answered on an other conn
+
+
+def iter_check_articles(checks, servers_used):
+    """
+    Yield the (check, row) of the articles to be requested on the news
+    server, the checks in order. Articles that are ok on a previous server
+    are skipped, as are the articles of a check that already failed.
+    """
+    for check in checks:
+        articles = check.articles
+        for row in range(len(articles)):
+            if not check.keep_checking() or check.out_of_time():
                 break
-            for i in socket_list:  # loop through ok sockets
-                reply = None
-                # break looping through sockets when already finished
-                if send_articles > articles_to_check - 1:
-                    break
-                try:
-                    reply = sockets[i].recv(chunk).decode("utf-8")
-                except:  # each error would trigger the same effect
-                    # avoid continuous looping on fast machines by adding delays
-                    #            EAGAIN, EWOULDBLOCK, ssl.SSLWantReadError
-                    #            socket.timeout:  # catching timeout for non SSL in 2.7.9+
-                    #            # https://bugs.python.org/issue10272
-                    # managing all possible socket errors
-                    err = sys.exc_info()
-                    if socket_loop_count[i] < 5:
-                        if EXTREME:
-                            print(
-                                "[E] Socket: "
-                                + str(i)
-                                + " "
-                                + str(err[0])
-                                + " "
-                                + str(err[1])
-                            )
-                            print(
-                                "[E] Socket: "
-                                + str(i)
-                                + " Failed to "
-                                + "get complete reply from server, waiting "
-                                + str(int(SOCKET_LOOP_INTERVAL * 1000 / num_conn))
-                                + " ms to avoid looping."
-                            )
-                            sys.stdout.flush()
-                        time.sleep(SOCKET_LOOP_INTERVAL / num_conn)
-                        socket_loop_count[i] += 1
-                        continue
-                    if socket_loop_count[i] == 5:
-                        if VERBOSE:
-                            print(
-                                "[V] Socket: "
-                                + str(i)
-                                + " No data "
-                                + "received on 5th retry, pausing script for 2 sec."
-                            )
-                            sys.stdout.flush()
-                        socket_loop_count[i] += 1
-                        time.sleep(2)
-                        continue
-                    elif socket_loop_count[i] >= 5:
-                        if VERBOSE:
-                            print(
-                                "[V] Socket: "
-                                + str(i)
-                                + " "
-                                + str(err[0])
-                                + " "
-                                + str(err[1])
-                            )
-                            print(
-                                "[V] Socket: "
-                                + str(i)
-                                + " Still no data "
-                                + "received after waiting for 1 sec, "
-                                + " marking requested article as failed."
-                            )
-                            sys.stdout.flush()
-                        reply = "999 Article marked as failed by script."
-                        failed_wait_count += 1
-                        if failed_wait_count >= 20:
-                            print(
-                                "[WARNING] Skipping current server as "
-                                + "it is replying very slow on header "
-                                + "requests for this NZB file"
-                            )
-                            loop_fail = True
-                            break  # exit for i loop
-                        pass
-                else:
-                    # normal reply received
-                    socket_loop_count[i] += 1
-                # reply will be empty string when error
-                if reply != None and rar_msg_ids[send_articles][4] > -1:
-                    socket_loop_count[i] = 0
-                    # loop over ok articles on previous servers
-                    while (
-                        send_articles < articles_to_check - 1
-                        and rar_msg_ids[send_articles][4] > -1
-                    ):
-                        if EXTREME:
-                            print(
-                                "[E] Article "
-                                + str(send_articles)
-                                + " already checked and available on server "
-                                + servers[rar_msg_ids[send_articles][4] - 1][2]
-                            )
-                        send_articles += 1
-                        if send_articles in message_on:
-                            print(
-                                "Requested ["
-                                + str(send_articles)
-                                + "/"
-                                + str(articles_to_check)
-                                + "] articles, "
-                                + str(failed_articles)
-                                + " failed."
-                            )
-                            sys.stdout.flush()
-                # msg received, and msg not checked/ok yet, and not all
-                # articles send:
-                if reply != None and rar_msg_ids[send_articles][4] == -1:
-                    socket_loop_count[i] = 0
-                    id = rar_msg_ids[send_articles][3]
-                    groups = rar_msg_ids[send_articles][2]
-                    group = groups[0]  # might not sufficient for cross posts
-                    (error, id_used, server_reply, msg_id_used) = (
-                        check_send_server_reply(
-                            sockets[i], reply, group, id, i, host, username, password
-                        )
-                    )
-                    if id_used and error:
-                        # ID of missing article is not returned by server
-                        failed_articles += 1
-                    # found ok article on server, store success:
-                    if id_used and not error and server_reply == "223":
-                        # find row index for successfully send article
-                        # (with reply)
-                        for j, rar_msg_id in enumerate(rar_msg_ids):
-                            if msg_id_used == rar_msg_id[3]:
-                                # store success serv num
-                                rar_msg_ids[j][4] = num_server
-                                break  # for j loop
-                    if id_used:  # avoids removing ids send before AUTH etc
-                        # rar_msg_ids starts with base 0
-                        send_articles += 1
-                        if send_articles in message_on:
-                            print(
-                                "Requested ["
-                                + str(send_articles)
-                                + "/"
-                                + str(articles_to_check)
-                                + "] articles, "
-                                + str(failed_articles)
-                                + " failed."
-                            )
-                            sys.stdout.flush()
-                failed_ratio = failed_articles * 100.0 / articles_to_check
-        # loop through all sockets, to catch the last server replies
-        # without sending new STAT messages, and allowing sockets to close
-        end_loop = True
-        end_count = 0
-        # loop over all sockets to try to catch all remaining replies
-        if EXTREME:
-            print("[E] Receiving remaining replies:")
-        # Start first loop after last socket used for receive to avoid errors
-        m = socket_list.index(i)
-        for k in range(0, 8):  # loop multiple so all data will be received
-            for i in socket_list[m:]:  # loop through ok sockets
-                reply = None
-                try:
-                    reply = sockets[i].recv(chunk).decode("utf-8")
-                except:  # managing all socket errors
-                    err = sys.exc_info()
-                    if socket_loop_count[i] < 5:
-                        if EXTREME:
-                            print(
-                                "[E] Socket: "
-                                + str(i)
-                                + " "
-                                + str(err[0])
-                                + " "
-                                + str(err[1])
-                            )
-                            print(
-                                "[E] Socket: "
-                                + str(i)
-                                + " Failed to "
-                                + "get complete reply from server, waiting "
-                                + str(int(SOCKET_LOOP_INTERVAL * 1000 / num_conn))
-                                + " ms to avoid looping."
-                            )
-                            sys.stdout.flush()
-                        time.sleep(SOCKET_LOOP_INTERVAL / num_conn)
-                        socket_loop_count[i] += 1
-                        continue
-                    if socket_loop_count[i] == 5:
-                        if VERBOSE:
-                            print(
-                                "[V] Socket: "
-                                + str(i)
-                                + ", no data "
-                                + "received on 5th retry, pausing script for 1 sec."
-                            )
-                            sys.stdout.flush()
-                        socket_loop_count[i] += 1
-                        time.sleep(1)
-                        continue
-                    elif socket_loop_count[i] >= 5:
-                        if VERBOSE:
-                            print(
-                                "[V] Socket: "
-                                + str(i)
-                                + " "
-                                + str(err[0])
-                                + " "
-                                + str(err[1])
-                            )
-                            print(
-                                "[V] Socket: "
-                                + str(i)
-                                + " Still no data "
-                                + "received after waiting for 1 sec, "
-                                + " marking request as failed."
-                            )
-                            sys.stdout.flush()
-                        reply = "999 request marked as failed by script."
-                        pass
-                if reply != None:
-                    socket_loop_count[i] = 0
-                    (error, id_used, server_reply, msg_id_used) = (
-                        check_send_server_reply(
-                            sockets[i],
-                            reply,
-                            group,
-                            id,
-                            i,
-                            host,
-                            username,
-                            password,
-                        )
+            if articles.status[row] > 0:
+                if EXTREME:
+                    print(
+                        "[E] Article "
+                        + str(row)
+                        + " already checked and available on server "
+                        + servers_used[articles.status[row] - 1]
                     )
-                    if error and server_reply in ("411", "420", "423", "430"):
-                        # ID of missing article is not returned by server
-                        failed_articles += 1
-                        end_count += 1
-                        if end_count >= num_conn:
-                            print(
-                                "All requested replies received, "
-                                + str(failed_articles)
-                                + " failed."
-                            )
-                    # found ok article on server, store success:
-                    elif not error and server_reply == "223":
-                        # find row index for successfully send article
-                        # (with recv reply)
-                        for j, rar_msg_id in enumerate(rar_msg_ids):
-                            if msg_id_used == rar_msg_id[3]:
-                                # store success serv num
-                                rar_msg_ids[j][4] = num_server
-                                break  # for j loop
-                        end_count += 1
-                        if end_count >= num_conn:
-                            print(
-                                "All requested article replies received, "
-                                + str(failed_articles)
-                                + " failed."
-                            )
-                    elif not error and server_reply == "205":
-                        # socket closed in check_send_server_reply
-                        socket_list.remove(i)
-                if failed_ratio != 100:
-                    failed_ratio = failed_articles * 100.0 / articles_to_check
-            m = 0
-            if len(socket_list) == 0:
-                break  # for k loop
-        if len(socket_list) > 0:  # kill still open sockets
-            for i in socket_list:
-                try:
-                    sockets[i].send("QUIT\r\n")
-                    sockets[i].close
-                except:
-                    continue
-            time.sleep(
-                SOCKET_LOOP_INTERVAL
-            )  # waiting and pray the connection will be closed
+                check.count_send()
+                check.answered += 1
+                continue
+            yield (check, row)
+
+
+def send_nntp(conn, text):
+    if EXTREME:
         print(
-            "Failed ratio for server: "
-            + host
-            + ": "
-            + str(round(failed_ratio, 1))
-            + "%. Server check completed in "
-            + str(round(time.time() - start_time, 2))
-            + " sec."
+            "[E] Socket: " + str(conn.i) + " " + conn.server[2] + ", Send: " + str(text)
         )
-        if failed_ratio < failed_limit or failed_ratio == 0:  # ok on last provider
+    conn.sock.send(text.encode("utf-8"))
+    conn.wait_start = time.time()
+
+
+def recv_nntp_lines(conn):
+    """
+    Receive all data available on the connection, return the complete reply
+    lines and if the connection is closed by the news server.
+    """
+    closed = False
+    while True:
+        try:
+            data = conn.sock.recv(4096)
+        except (BlockingIOError, InterruptedError, ssl.SSLWantReadError):
             break
-    return failed_ratio
+        except OSError as e:
+            if VERBOSE:
+                print("[V] Socket: " + str(conn.i) + " " + str(e))
+            closed = True
+            break
+        if not data:
+            closed = True
+            break
+        conn.buffer += data
+    lines = conn.buffer.split(b"\r\n")
+    conn.buffer = lines.pop()  # incomplete line
+    return ([line.decode("utf-8", "replace") for line in lines], closed)
 
 
-def handle_corrupted_lock_file(f_name, server_time):
-    print(f"[WARNING] Corrupted lock file found at {f_name}. Attempting to recreate.")
+def close_nntp(conn, selector, quit=True):
+    selector.unregister(conn.sock)
     try:
-        os.remove(f_name)
-    except OSError as e:
-        print(f"[ERROR] Failed to remove corrupted lock file, reason {e}")
-        return True
-    try:
-        with open(f_name, encoding="utf-8", mode="w") as fd:
-            fd.write(str(server_time))
-            print(f"[INFO] New completion.lock file created.")
-            return False
-
-    except OSError as e:
-        print(f"[ERROR] recreating lock file after corruption: {e}")
-        return True
+        if quit:
+            conn.sock.send("QUIT\r\n".encode("utf-8"))
+        conn.sock.close()
+    except OSError:
+        pass
+    if VERBOSE:
+        print("[V] Socket " + str(conn.i) + " closed.")
 
 
-def lock_file():
+def reconnect_nntp(conn, selector, articles_to_check, count=True):
     """
-    This function checks if the .lock file is there, if it is created
-    before or after a restart of NZBGet. This prevents the script from
-    running twice at the same time. It returns True when there is a valid
-    .lock file, otherwise it will return false and create one.
+    Replace a lost connection by a new connection to the same news server,
+    at most NNTP_RECONNECTS times, not counting the connections closed for
+    a late reply of a hedged request. The login is done again after the
+    welcome message, when the news server asks for it.
     """
+    if count and conn.reconnects >= NNTP_RECONNECTS:
+        return None
     if VERBOSE:
-        print("[V] lock_file()")
-    NZBGet = connect_to_nzbget()
-    nzbget_status = NZBGet.status()  # Get NZB status info XML-RPC
-    server_time = nzbget_status["ServerTime"]
-    up_time = nzbget_status["UpTimeSec"]
-    tmp_path = os.environ["NZBOP_TEMPDIR"] + os.sep + "completion"
-    try:
-        os.makedirs(tmp_path)
-    except OSError as exc:
-        if exc.errno == errno.EEXIST and os.path.isdir(tmp_path):
-            pass
-        else:
-            raise
-    f_name = tmp_path + os.sep + "completion.lock"
-    file_exists = os.path.isfile(f_name)
-    if file_exists:
-        fd = open(f_name, encoding="utf-8")
-        time_stamp = 0
-        try:
-            time_stamp = int(fd.readline())
-        except ValueError:
-            return handle_corrupted_lock_file(f_name, server_time)
-
-        if VERBOSE:
-            print(
-                "[V] time_stamp from completion.lock file= " + str(time_stamp)
-            )  ## added for debug issue reported by blackhawkpr, probably no time stamp in lock file
-        fd.close()
-        # Check if the .lock file was created before or after the last restart
-        if server_time - up_time > time_stamp:
-            # .lock created before restart, overwrite .lock file time_stamp
-            fd = open(f_name, encoding="utf-8", mode="w")
-            fd.write(str(server_time))
-            fd.close()
-            if VERBOSE:
-                print("[V] Old completion.lock file overwritten.")
-            return False
-        # Check if the .lock file is not older than 30 minutes
-        elif server_time - 1800 > time_stamp:
-            print(
-                "[ERROR] Script seems to be running for more than 30 "
-                + "minutes and has most likely crashed. Check your logs and "
-                "report the log and errors at "
-                + "https://github.com/nzbgetcom/Extension-Completion/issues"
-            )
-            # overwrite .lock file time_stamp
-            fd = open(f_name, encoding="utf-8", mode="w")
-            fd.write(str(server_time))
-            fd.close()
-            if VERBOSE:
-                print("[V] Existing completion.lock file overwritten.")
-            nzbget_resume()
-            return False
-        else:
-            # .lock created after restart, script is running at this moment
-            # don't start script
-            if VERBOSE:
-                print("[V] Script is already running, check canceled.")
-            return True
-    else:
-        fd = open(f_name, encoding="utf-8", mode="w")
-        fd.write(str(server_time))
-        fd.close()
-        if VERBOSE:
-            ## added for debug issue reported by blackhawkpr
-            print("[V] server_time= " + str(server_time))
-            print("[V] New completion.lock file created.")
-        return False
+        print("[V] Socket: " + str(conn.i) + " Reconnecting to " + conn.server[2])
+    (sockets, failed_sockets, conn_err) = create_sockets(
+        conn.server, articles_to_check, 1
+    )
+    if sockets[0] is None or conn_err > 0:
+        return None
+    new_conn = NntpConnection(conn.i, sockets[0], conn.server)
+    new_conn.reconnects = conn.reconnects + (1 if count else 0)
+    selector.register(new_conn.sock, selectors.EVENT_READ, new_conn)
+    return new_conn
 
 
-def del_lock_file():
+def set_article_result(item, found, num_server):
     """
-    Delete the .lock file
+    store the STAT result of the article (check, row)
     """
-    if VERBOSE:
-        print("[V] del_lock_file()")
-    f_name = os.path.join(os.environ["NZBOP_TEMPDIR"], "completion", "completion.lock")
-    os.remove(f_name)
-    if VERBOSE:
-        print("[V] completion.lock file deleted")
+    (check, row) = item
+    check.answered += 1
+    if found:
+        check.articles.status[row] = num_server  # store success serv num
+    else:
+        check.count_failed()  # ID of missing article is not returned by server
+
+
+def hedge_pending(conn, conns):
+    """
+    True when the article requested on conn is requested on an other
+    connection as well, the reply on that one is used.
+    """
+    return any(
+        other is not conn and other.pending is conn.pending for other in conns
+    )
+
+
+def check_server(server, num_server, checks, servers_used):
+    """
+    Check the articles of the checks, that are not ok on a previous server,
+    on a single news server. All checks share the connections of the news
+    server, on each connection a next STAT is send as soon as the reply on
+    the previous one is received. Each message id is requested once per
+    server in a run, the result is shared by all checks with the article.
+    When all articles are requested, a request waiting longer than 95% of
+    the replies so far is send again on an idle connection (hedged), the
+    first reply is used.
+    """
+    host = server[2]
+    mirrors = server[11]
+    start_time = time.time()
+    if mirrors == []:
+        print("Using server: " + host)
+    else:
+        print(
+            "Using server: "
+            + host
+            + ", with the same group servers: "
+            + ", ".join(mirror[2] for mirror in mirrors)
+        )
+    sys.stdout.flush()
+    articles_to_check = 0
+    for check in checks:
+        check.failed_articles = 0
+        check.send_articles = 0
+        check.failed_ratio = 0
+        check.answered = 0
+        articles_to_check += check.articles.status.count(0)
+    if articles_to_check == 0:
+        return
+    selector = selectors.DefaultSelector()
+    conns = []
+    num_conn = 0
+    endpoints_ok = set()  # servers that replied on a STAT
+    endpoints_failed = set()  # servers without connection / account error
+    # build the (non) ssl sockets per server, and its same group servers
+    for endpoint in [server] + mirrors:
+        (sockets, failed_sockets, conn_err) = create_sockets(
+            endpoint, articles_to_check
+        )
+        endpoint_conns = 0
+        for i in range(len(sockets)):
+            if i not in failed_sockets and sockets[i] is not None:
+                conn = NntpConnection(num_conn + i, sockets[i], endpoint)
+                selector.register(conn.sock, selectors.EVENT_READ, conn)
+                conns.append(conn)
+                endpoint_conns += 1
+        if endpoint_conns == 0:
+            endpoints_failed.add(get_server_key(endpoint))
+        num_conn += len(sockets)
+    if conns == []:
+        print("[WARNING] Skipping server: " + host)
+        selector.close()
+        for endpoint in [server] + mirrors:
+            breaker_failure(endpoint)
+        for check in checks:
+            check.failed_ratio = 100
+            check.broken = True
+        return
+    work = iter_check_articles(checks, servers_used)
+    retry = deque()  # articles requested on a lost connection
+    waiting = {}  # (server id, msg id) requested -> other (check, row)
+    server_id = server[9]
+    shared_articles = 0
+    work_left = True
+    failed_wait_count = 0
+    loop_fail = False
+    latencies = []  # reply times of the STAT requests of this server check
+    hedge_after = NNTP_REPLY_TIME_OUT
+    hedge_count = 0  # number of latencies hedge_after is based on
+    hedged = set()  # message ids requested on a second connection
+    stalled = set()  # message ids without reply in NNTP_REPLY_TIME_OUT
+    while not loop_fail:
+        # request the next articles on the idle connections
+        for conn in conns:
+            while conn.ready and conn.pending is None and conn.discard == 0:
+                item = None
+                while retry and item is None:
+                    item = retry.popleft()
+                    if not item[0].keep_checking() or item[0].out_of_time():
+                        item = None
+                if item is None and work_left:
+                    item = next(work, None)
+                    work_left = item is not None
+                    if item is not None:
+                        item[0].count_send()
+                if item is None:
+                    break
+                (check, row) = item
+                msg_id = check.articles.msg_ids[row]
+                key = (server_id, msg_id)
+                if key in stat_results:
+                    # same article already requested for an other NZB
+                    if EXTREME:
+                        print("[E] Article " + msg_id + " already requested.")
+                    set_article_result(item, stat_results[key], num_server)
+                    shared_articles += 1
+                    continue
+                if key in waiting:
+                    # reply on the request for an other NZB is used
+                    waiting[key].append(item)
+                    shared_articles += 1
+                    continue
+                waiting[key] = []
+                conn.pending = item
+                # STAT is faster than HEAD
+                send_nntp(conn, CHECK_METHOD + " <" + msg_id + ">\r\n")
+        select_wait = SOCKET_LOOP_INTERVAL
+        if not work_left and not retry:
+            if all(
+                conn.pending is None or conn.pending[0].out_of_time()
+                for conn in conns
+            ):
+                break
+            # request slow articles again on the idle connections
+            idle = [
+                conn
+                for conn in conns
+                if conn.ready and conn.pending is None and conn.discard == 0
+            ]
+            if idle and hedge_count != len(latencies):
+                hedge_count = len(latencies)
+                if hedge_count >= HEDGE_MIN_REPLIES:
+                    hedge_after = sorted(latencies)[int(hedge_count * 0.95)]
+            now = time.time()
+            for slow in sorted(
+                (conn for conn in conns if conn.pending is not None),
+                key=attrgetter("wait_start"),
+            ):
+                if not idle:
+                    break
+                (check, row) = slow.pending
+                msg_id = check.articles.msg_ids[row]
+                if msg_id in hedged:
+                    continue
+                if now - slow.wait_start < hedge_after:
+                    select_wait = min(select_wait, slow.wait_start + hedge_after - now)
+                    break
+                if VERBOSE:
+                    print(
+                        "[V] Socket: "
+                        + str(slow.i)
+                        + " No reply after "
+                        + str(round(now - slow.wait_start, 2))
+                        + " sec, requesting "
+                        + msg_id
+                        + " again."
+                    )
+                conn = idle.pop()
+                conn.pending = slow.pending
+                hedged.add(msg_id)
+                send_nntp(conn, CHECK_METHOD + " <" + msg_id + ">\r\n")
+        if len(conns) == 0:
+            print("[WARNING] Lost all connections to server: " + host)
+            loop_fail = True
+            break
+        for key, events in selector.select(select_wait):
+            conn = key.data
+            (lines, closed) = recv_nntp_lines(conn)
+            account_error = False
+            for reply in lines:
+                if conn.discard > 0 and conn.pending is None:
+                    # late reply on a hedged request, the conn is idle again
+                    conn.discard -= 1
+                    if EXTREME:
+                        print("[E] Socket: " + str(conn.i) + " Ignored: " + reply)
+                    continue
+                group = ""
+                if conn.pending is not None:
+                    (check, row) = conn.pending
+                    # might not sufficient for cross posts
+                    group = check.articles.groups(row)[0]
+                (error, ready, server_reply, msg_id_used) = check_send_server_reply(
+                    conn.sock, reply, group, conn.i, *conn.login
+                )
+                if conn.pending is not None and (
+                    error or server_reply in ("221", "223")
+                ):
+                    (check, row) = conn.pending
+                    key = (server_id, check.articles.msg_ids[row])
+                    stat_results[key] = not error
+                    latency = time.time() - conn.wait_start
+                    latencies.append(latency)
+                    add_server_stat(conn.server, check.bucket, not error, latency)
+                    endpoints_ok.add(get_server_key(conn.server))
+                    if key[1] in hedged:
+                        # first reply is used, the late reply is ignored
+                        for other in conns:
+                            if other is not conn and other.pending is conn.pending:
+                                other.pending = None
+                                if other.ready:  # not in the login
+                                    other.discard += 1
+                    for item in [conn.pending] + waiting.pop(key, []):
+                        set_article_result(item, not error, num_server)
+                    conn.pending = None
+                conn.ready = ready
+                if server_reply == "205" or (
+                    str(server_reply[:2]) in ("48", "50") and server_reply != "480"
+                ):
+                    # closed or incorrect news server account settings
+                    if server_reply != "205":
+                        endpoints_failed.add(get_server_key(conn.server))
+                        account_error = True
+                    closed = True
+                    break
+                if ready and conn.pending is not None:
+                    # request again after the login or GROUP command
+                    (check, row) = conn.pending
+                    text = CHECK_METHOD + " <" + check.articles.msg_ids[row] + ">\r\n"
+                    send_nntp(conn, text)
+            if closed:
+                if conn.pending is not None and not hedge_pending(conn, conns):
+                    (check, row) = conn.pending
+                    key = (server_id, check.articles.msg_ids[row])
+                    retry.append(conn.pending)
+                    retry.extend(waiting.pop(key, []))
+                    hedged.discard(key[1])
+                close_nntp(conn, selector, quit=False)
+                conns.remove(conn)
+                if not account_error and (work_left or retry):
+                    new_conn = reconnect_nntp(conn, selector, articles_to_check)
+                    if new_conn is not None:
+                        conns.append(new_conn)
+        # news servers that don't reply in time, request the article again
+        now = time.time()
+        for conn in list(conns):
+            if conn.ready and conn.pending is None and conn.discard == 0:
+                continue
+            if now - conn.wait_start < NNTP_REPLY_TIME_OUT:
+                continue
+            if VERBOSE:
+                print(
+                    "[V] Socket: "
+                    + str(conn.i)
+                    + " Still no data received after waiting for "
+                    + str(NNTP_REPLY_TIME_OUT)
+                    + " sec, closing connection."
+                )
+                sys.stdout.flush()
+            check_send_server_reply(
+                conn.sock,
+                "999 No reply received in time.",
+                "",
+                conn.i,
+                *conn.login,
+            )
+            if conn.pending is not None:
+                (check, row) = conn.pending
+                key = (server_id, check.articles.msg_ids[row])
+                add_server_stat(conn.server, check.bucket, False, NNTP_REPLY_TIME_OUT)
+                if hedge_pending(conn, conns):
+                    pass
+                elif key[1] not in stalled:
+                    retry.append(conn.pending)
+                    retry.extend(waiting.pop(key, []))
+                    hedged.discard(key[1])
+                else:
+                    # no reply on any connection, mark the article as failed
+                    for item in [conn.pending] + waiting.pop(key, []):
+                        item[0].count_failed()
+                stalled.add(key[1])
+            close_nntp(conn, selector)
+            conns.remove(conn)
+            if work_left or retry:
+                new_conn = reconnect_nntp(
+                    conn, selector, articles_to_check, conn.pending is not None
+                )
+                if new_conn is not None:
+                    conns.append(new_conn)
+            failed_wait_count += 1
+            if failed_wait_count >= 20:
+                print(
+                    "[WARNING] Skipping current server as "
+                    + "it is replying very slow on header "
+                    + "requests for this NZB file"
+                )
+                loop_fail = True
+                break
+    for conn in conns:
+        close_nntp(conn, selector)
+    selector.close()
+    for endpoint in [server] + mirrors:
+        if get_server_key(endpoint) in endpoints_ok:
+            breaker_success(endpoint)
+        elif get_server_key(endpoint) in endpoints_failed:
+            breaker_failure(endpoint)
+    if VERBOSE and shared_articles > 0:
+        print(
+            "[V] "
+            + str(shared_articles)
+            + " articles shared with other NZBs, not requested again."
+        )
+    for check in checks:
+        if loop_fail:
+            check.failed_ratio = 100
+        print(
+            check.prefix()
+            + "Failed ratio for server: "
+            + host
+            + ": "
+            + str(round(check.failed_ratio, 1))
+            + "%. Server check completed in "
+            + str(round(time.time() - start_time, 2))
+            + " sec."
+        )
+
+
+def get_age_bucket(nzb_age):
+    """
+    Post age bucket of the server stats, e.g. "<6h"
+    """
+    hours = (time.time() - nzb_age) / 3600.0
+    for limit in SERVER_STATS_AGE_BUCKETS:
+        if hours < limit:
+            return "<%dh" % limit
+    return ">%dh" % SERVER_STATS_AGE_BUCKETS[-1]
+
+
+def get_server_key(server):
+    return str(server[2]) + ":" + str(server[3])  # host:port
+
+
+def get_server_stats():
+    """
+    STAT requests, found articles and total STAT time in sec of earlier
+    checks, for each news server and post age bucket. Stored in
+    completion/servers.json.
+    """
+    global server_stats
+    if server_stats is None:
+        try:
+            with open(os.path.join(get_tmp_path(), "servers.json")) as fd:
+                server_stats = json.load(fd)
+        except (OSError, ValueError):
+            server_stats = {}
+    return server_stats
+
+
+def add_server_stat(server, bucket, found, latency):
+    stats = get_server_stats().setdefault(get_server_key(server), {})
+    stat = stats.setdefault(bucket, [0, 0, 0.0])
+    stat[0] += 1
+    stat[1] += 1 if found else 0
+    stat[2] += latency
+    if stat[0] >= SERVER_STATS_MAX:
+        # halve, so the stats follow changes of the news server
+        stats[bucket] = [stat[0] / 2.0, stat[1] / 2.0, stat[2] / 2.0]
+
+
+def save_server_stats():
+    if server_stats is None:
+        return
+    f_name = os.path.join(get_tmp_path(), "servers.json")
+    try:
+        with open(f_name + ".tmp", encoding="utf-8", mode="w") as fd:
+            json.dump(server_stats, fd)
+        os.replace(f_name + ".tmp", f_name)
+    except OSError as e:
+        print("[WARNING] Server stats not saved: " + str(e))
+
+
+def get_breakers():
+    """
+    Circuit breakers of the news servers that failed in earlier checks:
+    [failures, open time, cooldown sec]. Stored in completion/breakers.json.
+    """
+    global breakers
+    if breakers is None:
+        try:
+            with open(os.path.join(get_tmp_path(), "breakers.json")) as fd:
+                breakers = json.load(fd)
+        except (OSError, ValueError):
+            breakers = {}
+    return breakers
+
+
+def save_breakers():
+    if breakers is None:
+        return
+    f_name = os.path.join(get_tmp_path(), "breakers.json")
+    try:
+        with open(f_name + ".tmp", encoding="utf-8", mode="w") as fd:
+            json.dump(breakers, fd)
+        os.replace(f_name + ".tmp", f_name)
+    except OSError as e:
+        print("[WARNING] Circuit breakers not saved: " + str(e))
+
+
+def breaker_open(server):
+    """
+    True when the news server failed BREAKER_FAILURES times in a row, and
+    its cooldown is not over. After the cooldown the server is tried again
+    (half-open), a next failure opens the breaker with a doubled cooldown.
+    """
+    breaker = get_breakers().get(get_server_key(server))
+    if breaker is None or breaker[0] < BREAKER_FAILURES:
+        return False
+    return time.time() < breaker[1] + breaker[2]
+
+
+def servers_down():
+    """
+    True when the circuit breaker of every active news server listed in
+    Servers and FillServers is open.
+    """
+    if all(breaker[0] < BREAKER_FAILURES for breaker in get_breakers().values()):
+        return False
+    servers = [
+        server
+        for server in get_server_table()
+        if server[10]
+        and (SERVERS[0] == "" or server[9] in SERVERS or server[9] in FILL_SERVERS)
+    ]
+    return servers != [] and all(breaker_open(server) for server in servers)
+
+
+def breaker_failure(server):
+    breaker = get_breakers().setdefault(
+        get_server_key(server), [0, 0, BREAKER_COOLDOWN_SEC]
+    )
+    breaker[0] += 1
+    if breaker[0] >= BREAKER_FAILURES:
+        if breaker[1] != 0:  # failed again after the cooldown
+            breaker[2] = min(breaker[2] * 2, BREAKER_MAX_COOLDOWN_SEC)
+        breaker[1] = time.time()
+        print(
+            "[WARNING] Skipping server "
+            + server[2]
+            + " for "
+            + str(int(breaker[2] / 60))
+            + " min after "
+            + str(breaker[0])
+            + " failed checks."
+        )
+
+
+def breaker_success(server):
+    if get_breakers().pop(get_server_key(server), None) is not None:
+        if VERBOSE:
+            print("[V] Server " + server[2] + " is available again.")
+
+
+def order_servers(servers, nzb_age):
+    """
+    Order the news servers on the expected time to find the articles of an
+    NZB of this age in earlier checks: STAT time per connection divided by
+    the ratio of found articles. FillServers stay last. A server keeps its
+    NZBGet position till it has SERVER_STATS_MIN requests for the age, the
+    servers with enough stats are ordered on the other positions.
+    """
+    bucket = get_age_bucket(nzb_age)
+    expected = {}
+    for server in servers:
+        if server[9] in FILL_SERVERS:
+            continue
+        stat = get_server_stats().get(get_server_key(server), {}).get(bucket)
+        if stat is None or stat[0] < SERVER_STATS_MIN:
+            if VERBOSE:
+                print(
+                    "[V] Not enough stats of "
+                    + server[2]
+                    + " for NZBs of age "
+                    + bucket
+                    + ", keeping its NZBGet position."
+                )
+            continue
+        (requests, found, latency) = stat
+        connections = sum(int(s[7]) for s in [server] + server[11])
+        per_article = latency / requests / max(connections, 1)
+        expected[server[9]] = per_article / max(found / requests, 0.01)
+    if len(expected) < 2:
+        return servers  # nothing to order
+    ranked = iter(
+        sorted(
+            (server for server in servers if server[9] in expected),
+            key=lambda server: expected[server[9]],
+        )
+    )
+    ordered = [next(ranked) if s[9] in expected else s for s in servers]
+    ordered.sort(key=lambda server: server[9] in FILL_SERVERS)
+    if VERBOSE:
+        print("[V] News servers ordered on stats for NZBs of age " + bucket + ":")
+        for server in ordered:
+            if server[9] in FILL_SERVERS:
+                info = ", FillServer"
+            elif server[9] in expected:
+                info = (
+                    ", expected "
+                    + str(round(expected[server[9]] * 1000, 2))
+                    + " ms per article"
+                )
+            else:
+                info = ", no stats yet"
+            print("[V] * " + str(server[2]) + ":" + str(server[3]) + info)
+    return ordered
+
+
+def read_nntp_line(reader):
+    line = reader.readline()
+    if not line:
+        raise OSError("connection closed by news server")
+    return line.decode("utf-8", "replace").rstrip("\r\n")
+
+
+def overview_command(sock, reader, server, text):
+    """
+    Send a NNTP command on the blocking overview connection, login when
+    the news server asks for it. Returns the reply, and the overview lines
+    for a 224 reply.
+    """
+    sock.sendall(text.encode("utf-8"))
+    reply = read_nntp_line(reader)
+    if reply[:3] == "480":
+        sock.sendall(("AUTHINFO USER " + server[4] + "\r\n").encode("utf-8"))
+        reply = read_nntp_line(reader)
+        if reply[:3] == "381":
+            sock.sendall(("AUTHINFO PASS " + server[5] + "\r\n").encode("utf-8"))
+            reply = read_nntp_line(reader)
+        if reply[:3] != "281":
+            return (reply, [])
+        sock.sendall(text.encode("utf-8"))
+        reply = read_nntp_line(reader)
+    lines = []
+    if reply[:3] == "224":
+        while True:
+            line = read_nntp_line(reader)
+            if line == ".":
+                break
+            lines.append(line[1:] if line.startswith("..") else line)
+    return (reply, lines)
+
+
+def get_overview_date(line):
+    """
+    post time of an overview line: number, subject, from, date, msg id, ..
+    """
+    try:
+        return parsedate_to_datetime(line.split("\t")[3]).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def find_overview_start(sock, reader, server, low, high, post_time):
+    """
+    Binary search on the overview dates for the article number in the
+    group, from which the articles are posted after post_time.
+    """
+    while high - low > OVERVIEW_BATCH:
+        mid = (low + high) // 2
+        text = "XOVER " + str(mid) + "-" + str(mid + 99) + "\r\n"
+        (reply, lines) = overview_command(sock, reader, server, text)
+        date = None
+        for line in lines:
+            date = get_overview_date(line)
+            if date is not None:
+                break
+        if date is None or date < post_time:
+            low = mid
+        else:
+            high = mid
+    return low
+
+
+def scan_overview(sock, reader, server, group, time_from, time_to, msg_ids):
+    """
+    Read the overview data of the group for the articles posted between
+    time_from and time_to, in batches of OVERVIEW_BATCH articles. Stops
+    when all msg_ids are found. Returns the message ids in the overview.
+    """
+    (reply, lines) = overview_command(sock, reader, server, "GROUP " + group + "\r\n")
+    if reply[:3] != "211":
+        if VERBOSE:
+            print("[V] Overview of " + group + " not available: " + reply)
+        return set()
+    (low, high) = (int(reply.split()[2]), int(reply.split()[3]))
+    first = find_overview_start(sock, reader, server, low, high, time_from)
+    last = min(high, first + OVERVIEW_MAX_ARTICLES - 1)
+    found = set()
+    for start in range(first, last + 1, OVERVIEW_BATCH):
+        end = min(last, start + OVERVIEW_BATCH - 1)
+        text = "XOVER " + str(start) + "-" + str(end) + "\r\n"
+        (reply, lines) = overview_command(sock, reader, server, text)
+        if reply[:3] not in ("224", "423"):
+            if VERBOSE:
+                print("[V] Overview of " + group + " not available: " + reply)
+            break
+        for line in lines:
+            fields = line.split("\t")
+            if len(fields) > 4:
+                found.add(fields[4].strip()[1:-1])
+        if msg_ids <= found:
+            break
+        if lines != [] and (get_overview_date(lines[-1]) or 0) > time_to:
+            break
+    return found
+
+
+def check_overview(server, num_server, checks):
+    """
+    Probe the articles of NZBs younger than OverviewAge with the overview
+    data of their main newsgroup. Fresh posts are in a small range of
+    article numbers, a few XOVER requests cover hundreds of articles. The
+    articles found are ok on the server, the others are checked by STAT in
+    check_server(). The overview data is kept for the run per server and
+    group, NZBs of the same group share it.
+    """
+    wanted = {}  # group -> [(check, rows)]
+    for check in checks:
+        if time.time() - check.age > OVERVIEW_AGE_SEC:
+            continue
+        articles = check.articles
+        rows = [row for row in range(len(articles)) if articles.status[row] == 0]
+        if rows == []:
+            continue
+        counts = {}
+        for row in rows:
+            group = articles.groups(row)[0]
+            counts[group] = counts.get(group, 0) + 1
+        wanted.setdefault(max(counts, key=counts.get), []).append((check, rows))
+    if wanted == {}:
+        return
+    sock = None
+    for group, items in wanted.items():
+        # posts taking hours have their first articles long before the age
+        time_from = min(check.first_post for check, rows in items) - OVERVIEW_SPAN_SEC
+        time_to = max(check.age for check, rows in items) + OVERVIEW_SPAN_SEC
+        msg_ids = set()
+        for check, rows in items:
+            msg_ids.update(check.articles.msg_ids[row] for row in rows)
+        key = (get_server_key(server), group)
+        cached = overview_cache.get(key)
+        if cached is None or cached[0] > time_from or cached[1] < time_to:
+            if cached is not None:
+                time_from = min(time_from, cached[0])
+                time_to = max(time_to, cached[1])
+            found = set()
+            try:
+                if sock is None:
+                    (sockets, failed_sockets, conn_err) = create_sockets(
+                        server, len(msg_ids), 1
+                    )
+                    if sockets[0] is None or conn_err > 0:
+                        return
+                    sock = sockets[0]
+                    sock.settimeout(NNTP_REPLY_TIME_OUT)
+                    reader = sock.makefile("rb")
+                    read_nntp_line(reader)  # welcome message
+                found = scan_overview(
+                    sock, reader, server, group, time_from, time_to, msg_ids
+                )
+            except (OSError, ValueError, IndexError) as e:
+                print("[WARNING] Overview of " + group + " failed: " + str(e))
+                if sock is not None:
+                    sock.close()
+                    sock = None
+            cached = (time_from, time_to, found)
+            overview_cache[key] = cached
+        ok = 0
+        for check, rows in items:
+            for row in rows:
+                msg_id = check.articles.msg_ids[row]
+                if msg_id in cached[2]:
+                    check.articles.status[row] = num_server
+                    stat_results[(server[9], msg_id)] = True
+                    ok += 1
+        print(
+            "Overview of "
+            + group
+            + ": "
+            + str(ok)
+            + " of "
+            + str(sum(len(rows) for check, rows in items))
+            + " articles found on server "
+            + server[2]
+        )
+    if sock is not None:
+        try:
+            sock.sendall("QUIT\r\n".encode("utf-8"))
+            sock.close()
+        except OSError:
+            pass
+
+
+def check_articles(checks, nzb_ages, first_posts=None):
+    """
+    Check the articles of one or more NZBs, the news servers for the age of
+    each NZB are used in order till the failed_ratio of the NZB is below its
+    failed_limit. The NZBs share the connections of the news servers.
+    first_posts are the post times of the first articles, the nzb_ages when
+    not given. Returns the failed_ratio of each check.
+    """
+    if first_posts is None:
+        first_posts = nzb_ages
+    servers = []  # all news servers used, sorted like get_server_settings()
+    check_servers = []  # news server ids for each check
+    settings = {}
+    broken = {}  # servers skipped by their circuit breaker, for each age
+    for check, nzb_age in zip(checks, nzb_ages):
+        if nzb_age not in settings:
+            # get news server provider settings
+            broken[nzb_age] = []
+            settings[nzb_age] = get_server_settings(nzb_age, broken[nzb_age])
+        check_servers.append([server[9] for server in settings[nzb_age]])
+        check.broken = broken[nzb_age] != []
+        for server in settings[nzb_age]:
+            if server not in servers:
+                servers.append(server)
+    servers.sort(key=itemgetter(1, 0))
+    if SERVER_ORDER == "Learned" and len(servers) > 1:
+        # order for the NZB with the highest priority
+        servers = order_servers(servers, nzb_ages[0])
+    for check, nzb_age, first_post in zip(checks, nzb_ages, first_posts):
+        check.bucket = get_age_bucket(nzb_age)
+        check.age = nzb_age
+        check.first_post = min(first_post or nzb_age, nzb_age)
+        check.deadline = check_deadline  # till the first request
+    for check, server_ids in zip(checks, check_servers):
+        if server_ids == []:
+            check.failed_ratio = 100
+            check.done = True
+    servers_used = [server[2] for server in servers]
+    num_server = 0
+    # looping through servers, until limited failure
+    for server in servers:
+        num_server += 1
+        active = []
+        for check, server_ids in zip(checks, check_servers):
+            if check.done or server[9] not in server_ids:
+                continue
+            if check.out_of_time():
+                check.timed_out = True
+                check.done = True
+                continue
+            if check.failed_ratio > MAX_FAILURE and MAX_FAILURE != 0:
+                print(check.prefix() + "[WARNING] failure ratio > MaxFailure.")
+                check.done = True
+                continue
+            active.append(check)
+        if active == []:
+            continue
+        if OVERVIEW_AGE > 0:
+            check_overview(server, num_server, active)
+        check_server(server, num_server, active, servers_used)
+        for check in active:
+            if check.out_of_time() and check.answered < len(check.articles):
+                check.timed_out = True
+                check.done = True
+            # ok on last provider
+            elif check.failed_ratio < check.failed_limit or check.failed_ratio == 0:
+                check.done = True
+    max_age = time.time() - AGE_LIMIT_SEC
+    for check, server_ids in zip(checks, check_servers):
+        if (
+            not check.timed_out
+            and not check.broken
+            and server_ids != []
+            and check.failed_ratio >= check.failed_limit
+            and check.age < max_age
+        ):
+            # articles missing on all news servers of a failed NZB
+            articles = check.articles
+            update_takedowns(
+                add_ids=[
+                    msg_id
+                    for row, msg_id in enumerate(articles.msg_ids)
+                    if articles.status[row] == 0
+                    and all(
+                        stat_results.get((server_id, msg_id)) is False
+                        for server_id in server_ids
+                    )
+                ]
+            )
+    save_server_stats()
+    save_breakers()
+    return [get_best_effort_ratio(check) for check in checks]
+
+
+def get_check_deadline():
+    """
+    End of the check time of an NZB of which the first article is requested
+    now, the MaxNzbCheckTime from now, but not after the MaxCheckTime of the
+    run. None without limits.
+    """
+    deadline = check_deadline
+    if MAX_NZB_CHECK_TIME > 0:
+        nzb_deadline = time.time() + MAX_NZB_CHECK_TIME
+        if deadline is None or nzb_deadline < deadline:
+            deadline = nzb_deadline
+    return deadline
+
+
+def get_best_effort_ratio(check):
+    """
+    failed_ratio of the check, when the check time ran out estimated on the
+    articles with a result. The estimate is only used when the NZB is most
+    likely complete: upper bound of the 95% interval below the failed
+    limit. Otherwise None is returned, the NZB is checked again later. A
+    failing NZB of which a news server failed also gets None.
+    """
+    if check.broken and not (
+        (
+            check.failed_ratio < check.failed_limit
+            and (check.failed_ratio < MAX_FAILURE or MAX_FAILURE == 0)
+        )
+        or check.failed_ratio == 0
+    ):
+        # not marking the NZB BAD because of a news server outage
+        print(
+            check.prefix()
+            + "[WARNING] News server skipped after failures, failed ratio "
+            + "not used."
+        )
+        return None
+    if not check.timed_out:
+        return check.failed_ratio
+    (ratio, upper) = check.estimate()
+    print(
+        check.prefix()
+        + "[WARNING] Check time ran out, failed ratio "
+        + str(round(ratio, 1))
+        + "% (95% confidence: below "
+        + str(round(upper, 1))
+        + "%) based on "
+        + str(check.answered)
+        + " of "
+        + str(len(check.articles))
+        + " articles."
+    )
+    if upper < check.failed_limit and (upper < MAX_FAILURE or MAX_FAILURE == 0):
+        return ratio
+    return None
+
+
+def check_failure_status(rar_msg_ids, failed_limit, nzb_age, first_post=None):
+    """
+    Get the failed_ratio for each news server, if nth server failed_ratio
+    below failed_limit, return ok failure ratio for resuming
+    """
+    if EXTREME:
+        print(
+            "[E] check_failure_status(rar_msg_ids="
+            + str(rar_msg_ids.msg_ids)
+            + ", failed_limit="
+            + str(failed_limit)
+            + ")"
+        )
+    check = ArticleCheck(None, rar_msg_ids, failed_limit)
+    return check_articles([check], [nzb_age], [first_post])[0]
+
+
+def lock_file():
+    """
+    This function takes the lock on the .lock file, which prevents the
+    script from running twice at the same time. The lock is released by the
+    system when the script crashes. It returns True when the lock is held by
+    a running script, otherwise it will return false and hold the lock.
+    """
+    global lock_fd
+    if VERBOSE:
+        print("[V] lock_file()")
+    f_name = os.path.join(get_tmp_path(), "completion.lock")
+    fd = open(f_name, encoding="utf-8", mode="a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            fd.seek(0)
+            msvcrt.locking(fd.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        if VERBOSE:
+            owner = ""
+            if fcntl is not None:  # msvcrt locks block reading the file
+                fd.seek(0)
+                owner = fd.readline().strip().split(" ")[0]
+            print("[V] Script is already running (PID " + owner + "), check canceled.")
+        fd.close()
+        return True
+    fd.seek(0)
+    owner = fd.readline().split()  # PID and time of the check holding it
+    if len(owner) == 3 and owner[0].isdigit():
+        # previous script ended without releasing, NZBGet may still be paused
+        print(
+            "[WARNING] Previous check (PID "
+            + owner[0]
+            + ") ended unexpectedly, check your logs and report the log and "
+            + "errors at https://github.com/nzbgetcom/Extension-Completion/issues"
+        )
+        nzbget_resume()
+    elif owner != [] and VERBOSE:
+        # .lock file of an older version, holding the NZBGet server time
+        print("[V] Old style completion.lock replaced.")
+    fd.seek(0)
+    fd.truncate()
+    fd.write("%d %s\n" % (os.getpid(), time.strftime("%Y-%m-%d %H:%M:%S")))
+    fd.flush()
+    lock_fd = fd
+    if VERBOSE:
+        print("[V] completion.lock taken.")
+    return False
+
+
+def del_lock_file():
+    """
+    Release the lock on the .lock file, the file itself is kept
+    """
+    global lock_fd
+    if VERBOSE:
+        print("[V] del_lock_file()")
+    fd = lock_fd
+    lock_fd = None
+    fd.seek(0)
+    fd.truncate()  # released normally
+    fd.flush()
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        fd.seek(0)
+        msvcrt.locking(fd.fileno(), msvcrt.LK_UNLCK, 1)
+    fd.close()
+    if VERBOSE:
+        print("[V] completion.lock released")
+
+
+def queue_event():
+    """
+    Store the event of this call in the completion/events dir, the running
+    check handles it before it releases the .lock file. When the check ended
+    in the meantime, the queued events are handled by this call.
+    """
+    event = {"time": time.time(), "env": get_event_env()}
+    f_name = os.path.join(
+        get_tmp_path("events"), "%.6f-%d.json" % (event["time"], os.getpid())
+    )
+    with open(f_name + ".tmp", encoding="utf-8", mode="w") as fd:
+        json.dump(event, fd)
+    os.replace(f_name + ".tmp", f_name)  # complete events only
+    if VERBOSE:
+        print("[V] Check is running, event queued for it.")
+    if not lock_file():
+        drain_queued_events()
+        release_lock()
+
+
+def take_queued_events():
+    """
+    Read and remove the queued events, oldest first. Events that were
+    never completed (.tmp) are removed once they are old.
+    """
+    events_path = get_tmp_path("events")
+    events = []
+    for f_name in sorted(os.listdir(events_path)):
+        path = os.path.join(events_path, f_name)
+        if not f_name.endswith(".json"):
+            try:
+                if os.path.getmtime(path) < time.time() - EVENT_TMP_MAX_AGE_SEC:
+                    os.remove(path)
+            except OSError:
+                pass  # completed or removed by an other call
+            continue
+        try:
+            with open(path, encoding="utf-8") as fd:
+                events.append(json.load(fd))
+        except (OSError, ValueError):
+            pass  # removed by an other call, or damaged
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return events
+
+
+def events_queued():
+    """
+    Returns True when completed events are waiting in the events dir
+    """
+    return any(f.endswith(".json") for f in os.listdir(get_tmp_path("events")))
+
+
+def drain_queued_events():
+    """
+    Handle the events queued while checking, called while holding the
+    .lock file. All queued events are coalesced into a single check of the
+    queue, which is repeated till no new events are queued.
+    """
+    global queue_time
+    while True:
+        events = take_queued_events()
+        if events == []:
+            return
+        if VERBOSE:
+            print("[V] Checking the queue for " + str(len(events)) + " queued events")
+        reset_run()  # new queue data
+        queue_time = -1
+        for event in events:
+            if event["env"].get("NZBNA_EVENT") == "NZB_DOWNLOADED":
+                queue_time = max(queue_time, event["time"])
+        jobs = get_queue()
+        paused_jobs = jobs.paused_script_jobs()
+        if len(paused_jobs) > 0:
+            get_prio_nzb(jobs, paused_jobs)
+
+
+def release_lock():
+    """
+    Release the .lock file. Events queued after the last drain are handled
+    when no other call has taken over the .lock file.
+    """
+    del_lock_file()
+    while events_queued() and not lock_file():
+        drain_queued_events()
+        del_lock_file()
 
 
 def nzbget_paused():
@@ -1705,16 +3429,14 @@ def nzbget_paused():
     """
     if VERBOSE:
         print("[V] nzbget_paused()")
-    NZBGet = connect_to_nzbget()
-    nzbget_status = NZBGet.status()
-    nzbget_paused = nzbget_status["DownloadPaused"]
+    status = nzbget_status()
+    nzbget_paused = status["DownloadPaused"]
     if nzbget_paused:
         paused = True
     else:
         paused = False
-        nzbget_status = NZBGet.status()
-        download_rate = nzbget_status["DownloadRate"]
-        NZBGet.pausedownload()  # pause downloading in NZBGet
+        download_rate = status["DownloadRate"]
+        nzbget_pausedownload()  # pause downloading in NZBGet
         if VERBOSE:
             print("[V] Waiting for NZBGet to end downloading")
             sys.stdout.flush()
@@ -1727,8 +3449,8 @@ def nzbget_paused():
                 )
                 sys.stdout.flush()
             time.sleep(1)  # let the connections cool down 1 sec
-            nzbget_status = NZBGet.status()
-            download_rate = nzbget_status["DownloadRate"]
+            status = nzbget_status(refresh=True)
+            download_rate = status["DownloadRate"]
             if download_rate == 0:
                 if VERBOSE:
                     print(
@@ -1751,32 +3473,116 @@ def nzbget_resume():
     """
     if VERBOSE:
         print("[V] nzbget_resume()")
-    NZBGet = connect_to_nzbget()
-    NZBGet.resumedownload()  # resume downloading in NZBGet
+    nzbget_resumedownload()  # resume downloading in NZBGet
     if VERBOSE:
         print("[V] Downloading for NZBGet resumed")
 
 
+def get_prio_heap(paused_jobs, checked):
+    """
+    Heap of the paused jobs that are not checked yet: highest priority
+    first, then on nzb age with the oldest first, but older than
+    AgeSortLimit at the bottom in queue order.
+    """
+    max_age = int(time.time()) - int(AGE_SORT_LIMIT_SEC)
+    heap = []
+    for i, job in enumerate(paused_jobs):
+        if job.nzb_id in checked:
+            continue
+        if float(job.age) >= max_age:
+            heap.append((-job.priority, 0, job.age, i, job))
+        else:
+            heap.append((-job.priority, 1, 0, i, job))
+    heapq.heapify(heap)
+    return heap
+
+
+def iter_prio_nzbs(heap):
+    """
+    Yield the jobs of the heap in order as nzb list, only the jobs that
+    are checked are taken from the heap.
+    """
+    while heap:
+        job = heapq.heappop(heap)[-1]
+        nzb_dupe_key = job.dupe_key
+        if nzb_dupe_key == "":
+            nzb_dupe_key = "NONE"
+        yield job._replace(filename=get_nzb_filename(job), dupe_key=nzb_dupe_key)
+
+
+def get_sweep_cursor(paused_jobs):
+    """
+    NZB ids of the paused jobs checked in earlier runs of this round, the
+    next run continues with the next NZBs. When all paused jobs are checked
+    a new round is started.
+    """
+    try:
+        with open(os.path.join(get_tmp_path(), "sweep.json")) as fd:
+            checked = set(json.load(fd))
+    except (OSError, ValueError, TypeError):
+        checked = set()
+    checked.intersection_update(job.nzb_id for job in paused_jobs)
+    if len(checked) >= len(paused_jobs):
+        if checked and VERBOSE:
+            print("[V] All paused NZBs checked, starting a new round")
+        checked = set()
+    return checked
+
+
+def save_sweep_cursor(checked):
+    f_name = os.path.join(get_tmp_path(), "sweep.json")
+    try:
+        with open(f_name + ".tmp", encoding="utf-8", mode="w") as fd:
+            json.dump(sorted(checked), fd)
+        os.replace(f_name + ".tmp", f_name)
+    except OSError as e:
+        print("[WARNING] Sweep cursor not saved: " + str(e))
+
+
+def check_time_left():
+    """
+    False when the MaxCheckTime of the run is used, the NZBs that are not
+    checked remain paused for the next check.
+    """
+    if check_deadline is not None and time.time() > check_deadline:
+        print(
+            "[WARNING] MaxCheckTime of "
+            + str(MAX_CHECK_TIME)
+            + " sec used, remaining NZBs are checked next time."
+        )
+        return False
+    return True
+
+
 def get_prio_nzb(jobs, paused_jobs):
     """
     Get queue data from NZBGet marked paused_jobs in scan_call, sort data based
     on priority and age (oldest first, less chance of propagation, bigger
     chance it will be DMCAed. Check the first item in sorted queue, if file
     is incomplete, check next item etc. Only resume first succesfull file.
+    Items checked in earlier runs are skipped till all items are checked,
+    see get_sweep_cursor().
+    With SweepSize, that many items are checked at once, and all complete
+    items of the sweep are resumed. With MaxCheckTime, no new items are
+    checked when the time is used.
     """
     if EXTREME:
         print("[E] get_prio_nzb(paused_jobs=")
         for job in paused_jobs:
             print("[E] " + str(job))
+    global check_deadline
     start_time = time.time()
+    check_deadline = None
+    if MAX_CHECK_TIME > 0:
+        check_deadline = start_time + MAX_CHECK_TIME
     do_check = False
     if not IGNORE_QUEUE_PRIORITY:
         max_queued_priority = -1.7976931348623157e308
         # check if something is downloading, loop through jobs, extract max priority
         # of DOWNLOADING / QUEUED items
-        for job in jobs:
-            if job["Status"] in ("DOWNLOADING", "QUEUED"):
-                nzb_priority = job["MaxPriority"]
+        for status in ("DOWNLOADING", "QUEUED"):
+            for job in jobs.by_status.get(status, []):
+                nzb_priority = job.priority
                 if nzb_priority > max_queued_priority:
                     max_queued_priority = nzb_priority
         if VERBOSE and max_queued_priority != -1.7976931348623157e308:
@@ -1785,7 +3591,7 @@ def get_prio_nzb(jobs, paused_jobs):
                 + str(max_queued_priority)
             )
         for job in paused_jobs:
-            nzb_priority = job["MaxPriority"]
+            nzb_priority = job.priority
             if nzb_priority > max_queued_priority:
                 do_check = True
                 if VERBOSE and max_queued_priority != -1.7976931348623157e308:
@@ -1813,20 +3619,9 @@ def get_prio_nzb(jobs, paused_jobs):
             if VERBOSE:
                 print("[V] Not started because download is paused")
     if do_check and not paused:
-        if VERBOSE:
-            print("[V] Paused UNSORTED NZBs in queue that will be processed:")
-            for job in paused_jobs:
-                nzb_filename = get_nzb_filename(job["Parameters"])
-                print(
-                    "[V] * "
-                    + str(nzb_filename)
-                    + ", Age: "
-                    + str(round((int(time.time()) - job["MaxPostTime"]) / 3600.0, 1))
-                    + " hours, Priority: "
-                    + str(job["MaxPriority"])
-                )
-        # sort on nzb age, but move older than max-age to bottom, then
-        # sort of priority. Priority items will be on top.
+        # NZBs checked in earlier runs are skipped till all NZBs are checked
+        checked = get_sweep_cursor(paused_jobs)
+        heap = get_prio_heap(paused_jobs, checked)
         if VERBOSE:
             print(
                 "[V] Ignoring sorting priority of items older than "
@@ -1834,50 +3629,49 @@ def get_prio_nzb(jobs, paused_jobs):
                 + str(AGE_SORT_LIMIT)
                 + " hours"
             )
-        max_age = int(time.time()) - int(AGE_SORT_LIMIT_SEC)
-        t1 = sorted(
-            (j for j in paused_jobs if float(j["MaxPostTime"]) >= max_age),
-            key=itemgetter("MaxPostTime"),
-        )
-        t2 = []
-        for j in paused_jobs:
-            if float(j["MaxPostTime"]) < max_age:
-                t2.append(j)
-        for t in t2:
-            t1.append(t)
-        jobs_sorted = sorted(t1, key=itemgetter("MaxPriority"), reverse=True)
-        if VERBOSE:
             print("[V] Paused and SORTED NZBs in queue that will be processed:")
-            for job in jobs_sorted:
-                nzb_filename = get_nzb_filename(job["Parameters"])
+            for entry in heapq.nsmallest(PRIO_LIST_MAX, heap):
+                job = entry[-1]
                 print(
                     "[V] * "
-                    + str(nzb_filename)
+                    + str(get_nzb_filename(job))
                     + ", Age: "
-                    + str(round((int(time.time()) - job["MaxPostTime"]) / 3600.0, 1))
+                    + str(round((int(time.time()) - job.age) / 3600.0, 1))
                     + " hours, Priority: "
-                    + str(job["MaxPriority"])
+                    + str(job.priority)
                 )
-        for job in jobs_sorted:
-            nzb_filename = get_nzb_filename(job["Parameters"])
-            nzb_id = job["NZBID"]
-            nzb_age = job["MaxPostTime"]  # nzb age
-            nzb_critical_health = job["CriticalHealth"]
-            nzb_dupe_key = job["DupeKey"]  # if empty returns u''
-            if nzb_dupe_key == "":
-                nzb_dupe_key = "NONE"
-            nzb_dupe_score = job["DupeScore"]
-            nzb = [
-                nzb_id,
-                nzb_filename,
-                nzb_age,
-                nzb_critical_health,
-                nzb_dupe_key,
-                nzb_dupe_score,
-            ]
-            # do a completion check, returns true if ok and resumed
-            if get_nzb_status(nzb):
-                break
+            if len(heap) > PRIO_LIST_MAX:
+                print("[V] * and " + str(len(heap) - PRIO_LIST_MAX) + " more")
+            if checked:
+                print("[V] " + str(len(checked)) + " NZBs checked in earlier runs")
+        nzbs = iter_prio_nzbs(heap)
+        if servers_down():
+            # not marking the NZBs BAD because of a news server outage
+            print(
+                "[WARNING] All news servers failed in earlier checks, "
+                + "postponing check"
+            )
+        elif SWEEP_SIZE == 1:
+            for nzb in nzbs:
+                if not check_time_left():
+                    break
+                # do a completion check, returns true if ok and resumed
+                success = get_nzb_status(nzb)
+                checked.add(nzb.nzb_id)
+                if success:
+                    break
+        else:
+            # check SweepSize NZBs at once, till NZBs are resumed
+            sweep_size = SWEEP_SIZE if SWEEP_SIZE > 0 else len(heap)
+            while check_time_left():
+                sweep = list(itertools.islice(nzbs, sweep_size))
+                if sweep == []:
+                    break
+                success = get_sweep_status(sweep)
+                checked.update(nzb.nzb_id for nzb in sweep)
+                if success:
+                    break
+        save_sweep_cursor(checked)
         print(
             "Overall check completed in "
             + str(round(time.time() - start_time, 2))
@@ -1895,20 +3689,18 @@ def scheduler_call():
     queue_time = -1  # NZBGet closes connection after 5 sec. Avoid too much conn
     if VERBOSE:
         print("[V] scheduler_call()")
-    # data contains ALL properties each NZB in queue
-    data = call_nzbget_direct("listgroups")
-    jobs = json.loads(data)
+    jobs = get_queue()
     # check if nzb in queue, and check if paused by this script
-    if len(jobs["result"]) > 0 and "CnpNZBFileName" in str(jobs):
+    if len(jobs.script_jobs) > 0:
         if not lock_file():  # check if script is not already running
-            paused_jobs = []
-            for job in jobs["result"]:
-                # send only nzbs paused by the script
-                if "CnpNZBFileName" in str(job) and job["Status"] in ("PAUSED"):
-                    paused_jobs.append(job)
+            # send only nzbs paused by the script
+            paused_jobs = jobs.paused_script_jobs()
             if len(paused_jobs) > 0:
-                get_prio_nzb(jobs["result"], paused_jobs)
-            del_lock_file()
+                get_prio_nzb(jobs, paused_jobs)
+            drain_queued_events()
+            release_lock()
+        else:
+            queue_event()  # handled by the running check
     elif VERBOSE:
         print("[V] Empty queue")
 
@@ -1935,22 +3727,20 @@ def queue_call():
     ):
         # when NZB_DOWNLOADED occurs, the NZB is still in queue, with the
         # paused par2 etc.
-        # data contains ALL properties each NZB in queue
-        data = call_nzbget_direct("listgroups")
-        jobs = json.loads(data)
+        jobs = get_queue()
         # check if nzb in queue, and check if paused by this script
-        if len(jobs["result"]) > 0 and "CnpNZBFileName" in str(jobs):
+        if len(jobs.script_jobs) > 0:
             if not lock_file():  # check if script is not already running
-                paused_jobs = []
-                for job in jobs["result"]:
-                    # send only nzbs paused by the script
-                    if "CnpNZBFileName" in str(job) and job["Status"] in ("PAUSED"):
-                        paused_jobs.append(job)
+                # send only nzbs paused by the script
+                paused_jobs = jobs.paused_script_jobs()
                 if len(paused_jobs) > 0:
                     if event == "NZB_DOWNLOADED":
                         queue_time = time.time()
-                    get_prio_nzb(jobs["result"], paused_jobs)
-                del_lock_file()
+                    get_prio_nzb(jobs, paused_jobs)
+                drain_queued_events()
+                release_lock()
+            else:
+                queue_event()  # handled by the running check
 
 
 def scan_call():
@@ -2038,15 +3828,43 @@ def scan_call():
         if VERBOSE:
             print('[V] Expected queued file name: "' + nzb_filename + '"')
         print("[NZB] NZBPR_CnpNZBFileName=" + nzb_filename)
+        # parse the NZB now, so the check doesn't need to do it while NZBGet
+        # downloading is paused
+        source = os.environ["NZBNP_FILENAME"]
+        if os.path.isfile(source):
+            try:
+                prune_nzb_plans()
+                save_nzb_plan(nzb_filename, source, parse_nzb(source))
+            except Exception as e:
+                print(f"[WARNING] Failed to prepare check plan: {e}")
         # pausing NZB
         if VERBOSE:
             print('[V] Pausing: "' + os.environ["NZBNP_NZBNAME"] + '"')
         print("[NZB] PAUSED=1")
 
 
-def main():
+def reset_run():
     """
-    Check for which script type the script is called
+    Forget the NZBGet data of the previous run, the daemon handles each event
+    as a new run. The NZBGet connection and the check plans are kept.
+    """
+    global edit_queue, status_snapshot, server_table, history_index, stat_results
+    global breakers, overview_cache, result_cache, takedown_log, takedown_hashes
+    edit_queue = []
+    status_snapshot = None
+    server_table = None
+    history_index = None
+    stat_results = {}
+    breakers = None
+    overview_cache = {}
+    result_cache = None
+    takedown_log = None
+    takedown_hashes = None
+
+
+def run_event():
+    """
+    Start the scheduler / queue / button check for the event in the env
     """
     # check if the script is called as Scheduler Script
     if "NZBSP_TASKID" in os.environ:
@@ -2054,12 +3872,252 @@ def main():
     # Check if the script is called as Queue Script.
     if "NZBNA_NZBNAME" in os.environ:
         queue_call()
+    # check if the script is called via button
+    if "NZBCP_COMMAND" in os.environ:
+        scheduler_call()
+
+
+def get_event_env():
+    """
+    env of the NZBGet event that is send to the daemon
+    """
+    return {k: v for k, v in os.environ.items() if k.startswith(DAEMON_EVENT_ENV)}
+
+
+def get_options_id():
+    """
+    Fingerprint of the NZBGet and script options, a daemon started with
+    other options is replaced.
+    """
+    options = sorted(
+        (k, v) for k, v in os.environ.items() if k.startswith(("NZBOP_", "NZBPO_"))
+    )
+    return hashlib.sha1(json.dumps(options).encode("utf-8")).hexdigest()
+
+
+def get_daemon_path():
+    return os.path.join(get_tmp_path(), "completion.sock")
+
+
+def send_daemon_event():
+    """
+    Send the event to the daemon, the daemon is started when not running.
+    Returns False when the event needs to be handled by this process.
+    """
+    event = json.dumps({"options": get_options_id(), "env": get_event_env()})
+    started = False
+    end_time = time.time() + DAEMON_START_TIME_OUT
+    while True:
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(NNTP_TIME_OUT)
+            sock.connect(get_daemon_path())
+            sock.sendall((event + "\n").encode("utf-8"))
+            reply = sock.makefile("r", encoding="utf-8").readline().strip()
+            sock.close()
+            if VERBOSE:
+                print("[V] Event send to daemon, reply: " + reply)
+            return reply == "ok"
+        except OSError:
+            sock.close()
+        if time.time() > end_time:
+            print("[WARNING] Completion daemon not available, checking in process.")
+            return False
+        if not started:
+            start_daemon()
+            started = True
+        time.sleep(SOCKET_LOOP_INTERVAL)
+
+
+def start_daemon():
+    """
+    Start the daemon in the background, its output is written to the NZBGet
+    log via the RPC-API, errors to daemon.log in the completion dir.
+    """
+    if VERBOSE:
+        print("[V] Starting completion daemon")
+    log_file = open(os.path.join(get_tmp_path(), "daemon.log"), "a")
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--daemon"],
+        stdin=subprocess.DEVNULL,
+        stdout=log_file,
+        stderr=log_file,
+        start_new_session=True,
+    )
+    log_file.close()
+
+
+class NZBGetLog(io.TextIOBase):
+    """
+    stdout of the daemon, each line is send to the NZBGet log via the
+    writelog RPC-API method, or to the daemon.log when that fails.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.text = ""
+        self.sending = False
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.text += text
+        while "\n" in self.text:
+            (line, self.text) = self.text.split("\n", 1)
+            self.write_line(line)
+        return len(text)
+
+    def write_line(self, line):
+        if line.strip() == "":
+            return
+        kind = "INFO"
+        for prefix, prefix_kind in (
+            ("[WARNING]", "WARNING"),
+            ("[ERROR]", "ERROR"),
+            ("[INFO]", "INFO"),
+            ("[V]", "DETAIL"),
+            ("[E]", "DEBUG"),
+        ):
+            if line.startswith(prefix):
+                kind = prefix_kind
+                line = line[len(prefix) :].strip()
+                break
+        if not self.sending:  # no logging of the writelog call itself
+            self.sending = True
+            try:
+                call_nzbget("writelog", kind, "Completion: " + line)
+                return
+            except Exception:
+                pass
+            finally:
+                self.sending = False
+        self.fallback.write(kind + " " + line + "\n")
+        self.fallback.flush()
+
+
+def receive_daemon_events(server, events, ingest_lock, options_id):
+    """
+    Accept the events of the clients, the events are handled in order by
+    daemon_call(). Events of clients with other options than options_id,
+    the options of the daemon, are refused.
+    """
+    while True:
+        try:
+            (conn, address) = server.accept()
+        except OSError:
+            return  # server closed by daemon_call()
+        with ingest_lock:
+            try:
+                conn.settimeout(NNTP_TIME_OUT)
+                event = json.loads(conn.makefile("r", encoding="utf-8").readline())
+                if event["options"] != options_id:
+                    conn.sendall(b"restart\n")
+                    events.put(None)  # stop the daemon
+                else:
+                    events.put(event["env"])
+                    conn.sendall(b"ok\n")
+            except (OSError, ValueError, KeyError):
+                pass
+            conn.close()
+
+
+def handle_daemon_event(event_env):
+    """
+    Handle an event in the daemon, with the env of the client
+    """
+    for k in list(os.environ):
+        if k.startswith(DAEMON_EVENT_ENV):
+            del os.environ[k]
+    os.environ.update(event_env)
+    reset_run()
+    try:
+        run_event()
+    except Exception:
+        print("[ERROR] Completion daemon: " + str(sys.exc_info()[1]))
+        traceback.print_exc()
+    sys.stdout.flush()
+
+
+def daemon_call():
+    """
+    Script runs as daemon, started by send_daemon_event(). The events of the
+    queue / scheduler / button calls are handled one by one, while the
+    connection to NZBGet and the check plans stay in memory. The daemon
+    exits after DAEMON_IDLE_SEC without events.
+    """
+    sys.stdout = NZBGetLog(sys.stderr)
+    path = get_daemon_path()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        if os.path.exists(path):
+            try:
+                server.connect(path)
+                server.close()
+                return  # other daemon already running
+            except OSError:
+                os.remove(path)  # left by a crashed daemon
+                server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(16)
+    except OSError as e:
+        sys.stderr.write("Completion daemon not started: " + str(e) + "\n")
+        return
+    print("Completion daemon started")
+    events = queue.Queue()
+    ingest_lock = threading.Lock()
+    # the env of the events changes os.environ, the options don't change
+    options_id = get_options_id()
+    thread = threading.Thread(
+        target=receive_daemon_events,
+        args=(server, events, ingest_lock, options_id),
+        daemon=True,
+    )
+    thread.start()
+    while True:
+        try:
+            event_env = events.get(timeout=DAEMON_IDLE_SEC)
+        except queue.Empty:
+            break  # idle
+        if event_env is None:
+            break  # replaced by a daemon with other options
+        handle_daemon_event(event_env)
+    # stop receiving, and handle the events received while closing
+    with ingest_lock:
+        try:
+            server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        server.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    while not events.empty():
+        event_env = events.get()
+        if event_env is not None:
+            handle_daemon_event(event_env)
+    print("Completion daemon stopped")
+
+
+def main():
+    """
+    Check for which script type the script is called
+    """
+    if sys.argv[1:] == ["--daemon"]:
+        daemon_call()
+        return
+    # hand the scheduler / queue / button call to the daemon
+    handled = False
+    if DAEMON and hasattr(socket, "AF_UNIX") and "NZBNP_NZBNAME" not in os.environ:
+        handled = send_daemon_event()
+    if not handled:
+        run_event()
     # check if the script is called as Scan Script
     if "NZBNP_NZBNAME" in os.environ:
         scan_call()
     # check if the script is called via button
     if "NZBCP_COMMAND" in os.environ:
-        scheduler_call()
         sys.exit(93)
 
 
@@ -2085,9 +4143,6 @@ main()
 
 """ 
 TODO:
-    - User blackhawkpr had an issue related to a wrong or missing time stamp in
-      .lock file, can not reproduce, added additinal logging for it in VERBOSE 
-      logging.
     - HEAD will fails as it does not check if all packets are received before 
       asking for next HEAD. (Complete HEAD data ends with a .) HEAD 
       implementation for python 3 only. STAT always returns 1 packet
@@ -2106,32 +4161,67 @@ TODO:
 
 Script structure:
 - main() -> scan / queue / schedule / button call
-- scan -> pause typical incoming NZBs
+    - send_daemon_event() -> with Daemon, hand queue / schedule / button
+      events to daemon_call(), started by start_daemon() when needed
+    - run_event() -> queue / schedule / button call, in process or daemon
+- scan -> pause typical incoming NZBs, store check plan (save_nzb_plan())
 - queue / schedule / button -> start whole completion check loop, get queue data list
-    - lock_file() -> check if not running, otherwise create lock file
+    - lock_file() -> check if not running, otherwise take the lock
     - get_prio_nzb() -> sent highest prio / oldest within to check
+        - get_sweep_cursor() -> skip NZBs checked in earlier runs of a round
+        - get_prio_heap() -> order of the NZBs, taken by iter_prio_nzbs()
         - nzbget_paused() -> check if NZBGet not paused, pause NZBGet for check
+        - servers_down() -> postpone the check when all servers failed before
+        - check_time_left() -> stop checking when MaxCheckTime is used
         - get_nzb_status() -> handle results of article check: resume / keep
           paused / mark bad / mark failed
-            - get_nzb_data() -> extract the data from the nzb
-                - fix_nzb() -> fix 1 line nzbs
-            - check_failure_status() -> recv messages
-                - get_server_settings() -> extract NZBGet server info
-                - create_sockets() -> build sockets
-                - check_send_server_reply() -> check recv messages, article 
-                  ok/nok,
-                    login, send messages.
-                    - is_number() -> check if a str is a number
+        - get_sweep_status() -> same for SweepSize nzbs, checked at once
+            - prepare_nzb_check() -> collect the articles to check
+            - decide_nzb_status() -> resume / keep paused / mark bad
+            - get_known_ratio() -> failed ratio without a full check, the
+              sweep checks the probes with the other NZBs
+                - get_known_probe() -> known ratio and its confirm check
+                    - get_takedown_probe() -> known takedowns, confirmed by
+                      a few articles, see update_takedowns()
+                    - get_cached_probe() -> result of the same NZB checked
+                      before, confirmed on a sample, see save_check_result()
+                - get_confirmed_ratio() -> known ratio when confirmed
+            - get_nzb_data() -> load check plan stored by scan, or
+                - parse_nzb() -> extract the data from the nzb
+                    - open_nzb() -> open (compressed) nzbs
+                    - iter_nzb_lines() -> stream nzb lines, fix 1 line nzbs
+            - check_failure_status() -> check_articles() of a single nzb,
+              get_best_effort_ratio() when the check time ran out
+                - get_server_settings() -> filter NZBGet server info
+                    - get_server_table() -> extract NZBGet server info, once
+                    - breaker_open() -> skip servers that failed in earlier
+                      checks, see get_breakers()
+                - order_servers() -> with ServerOrder Learned, order on the
+                  stats of earlier checks, see get_server_stats()
+                - check_overview() -> with OverviewAge, find the articles of
+                  fresh NZBs in the XOVER data of their group
+                - check_server() -> STAT requests on all connections of a
+                  server, replies received via a selector
+                    - create_sockets() -> build sockets
+                    - check_send_server_reply() -> check recv messages,
+                      article ok/nok, login messages.
+                        - is_number() -> check if a str is a number
             - unpause_nzb() -> resume nzb if requested
             - mark_bad() -> mark nzb bad
             - force_failure() -> force a failure of nzb
-            - get_dupe_nzb_status()
+            - get_dupe_nzb_status() -> check_articles() of all DUPEs at once
                 - unpause_nzb_dupe() return dupe into queue
                 - mark_bad_dupe() mark dupe nzb bad
                 - force_failure_dupe() force nzb bad while returning to queue
+            - send_edits() -> send the queued editqueue commands of the
+              decision in one system.multicall
         - nzbget_resume() -> resume NZBGet if paused by nzbget_paused()
-    - del_lock_file -> delete created lock file.
+    - queue_event() -> when locked, queue the event for the running check
+    - drain_queued_events() -> check the queue again for queued events
+    - release_lock() -> release the lock, handle late events
 
-- connect_to_nzbget() -> connection to get data from NZBGet
-- call_nzbget_direct() -> connect and get data from NZBGet
+- nzbget_request() -> keep-alive connection to NZBGet
+- call_nzbget() -> JSON-RPC calls, via nzbget_status(), nzbget_listgroups(),
+  nzbget_history(), nzbget_listfiles(), nzbget_editqueue() etc.
+- nzbget_multicall() -> batched calls via XML-RPC system.multicall
 """
@@ -24,8 +24,14 @@ from os.path import dirname
 import os
 import subprocess
 import xmlrpc.server
+import xmlrpc.client
 import xml.etree.cElementTree as ET
 import shutil
+import gzip
+import re
+import socketserver
+import time
+from email.utils import formatdate
 
 SUCCESS = 93
 NONE = 95
@@ -72,7 +78,29 @@ def parse_array(array_elem):
     return array_data
 
 
+def get_status():
+    with open(TEST_DATA_DIR + "/status_resp.xml", "r") as f:
+        data = f.read().replace("\n", "").strip()
+        root = ET.fromstring(data)
+        response_dict = {}
+        for member in root.findall("member"):
+            name, value = parse_member(member)
+            response_dict[name] = value
+        return response_dict
+
+
+def get_listgroups():
+    with open(TEST_DATA_DIR + "/listgroups_resp.json") as f:
+        return json.load(f)["result"]
+
+
 class NZBGetServer(http.server.BaseHTTPRequestHandler):
+    listgroups = None  # replaces the listgroups test data when set
+    news_servers = None  # replaces the status NewsServers when set
+    history = []  # items in the history
+    edits = []  # (command, ids) of the editqueue calls received
+    log = []  # messages of the writelog calls received
+
     def do_GET(self):
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
@@ -85,24 +113,94 @@ class NZBGetServer(http.server.BaseHTTPRequestHandler):
 
     def do_POST(self):
         self.log_request()
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/xmlrpc":
+            params, method = xmlrpc.client.loads(body)
+            if method == "system.multicall":
+                for call in params[0]:
+                    if call["methodName"] == "editqueue":
+                        self.edits.append((call["params"][0], call["params"][3]))
+                result = [[True] for call in params[0]]
+            else:
+                result = get_status()
+            # Serialize Python object to XML-RPC response
+            response = xmlrpc.client.dumps((result,), methodresponse=True)
+            content_type = "text/xml"
+        else:
+            method = json.loads(body)["method"]
+            if method == "writelog":
+                self.log.append(json.loads(body)["params"][1])
+            if method == "status":
+                result = get_status()
+                if self.news_servers is not None:
+                    result["NewsServers"] = self.news_servers
+            elif method == "listgroups":
+                result = self.listgroups or get_listgroups()
+            elif method == "history":
+                result = self.history
+            else:
+                result = True
+            response = json.dumps({"version": "1.1", "result": result})
+            content_type = "application/json"
         self.send_response(200)
-        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Type", content_type)
         self.end_headers()
-        with open(TEST_DATA_DIR + "/status_resp.xml", "r") as f:
-            data = f.read().replace("\n", "").strip()
-            root = ET.fromstring(data)
-            response_dict = {}
-            for member in root.findall("member"):
-                name, value = parse_member(member)
-                response_dict[name] = value
+        # Send the serialized response to the client
+        self.wfile.write(response.encode("utf-8"))
 
-            # Serialize Python object to XML-RPC response
-            response = xmlrpc.client.dumps(
-                (response_dict,), allow_none=False, encoding=None
+
+class NNTPServer(socketserver.StreamRequestHandler):
+    missing = set()  # message ids reported as not found
+    slow = {}  # message id -> delay of each request of it, in sec
+    drop_after = 0  # STATs answered before the connection is closed
+    drops = None  # connections still to close, None for all
+    group = []  # (message id, post time) of the articles in the group
+
+    def overview(self, first, last):
+        lines = []
+        for num in range(max(first, 1), min(last, len(self.group)) + 1):
+            (msg_id, post_time) = self.group[num - 1]
+            lines.append(
+                "\t".join(
+                    [str(num), "test", "poster", formatdate(post_time)]
+                    + ["<" + msg_id + ">", "", "1000", "10"]
+                )
             )
+        return "".join(line + "\r\n" for line in lines)
 
-            # Send the serialized response to the client
-            self.wfile.write(response.encode("utf-8"))
+    def handle(self):
+        self.wfile.write(b"200 test server ready\r\n")
+        answered = 0
+        for line in self.rfile:
+            command = line.decode().split()
+            if command[0] == "QUIT":
+                self.wfile.write(b"205 closing connection\r\n")
+                break
+            if self.drop_after and answered == self.drop_after:
+                if self.drops is None:
+                    break  # lost without a reply on the request
+                if self.drops > 0:
+                    NNTPServer.drops -= 1
+                    break
+            if command[0] == "GROUP":
+                count = str(len(self.group))
+                reply = "211 " + count + " 1 " + count + " " + command[1]
+                self.wfile.write((reply + "\r\n").encode())
+                continue
+            if command[0] == "XOVER":
+                (first, last) = command[1].split("-")
+                lines = self.overview(int(first), int(last))
+                self.wfile.write(("224 overview\r\n" + lines + ".\r\n").encode())
+                continue
+            answered += 1
+            msg_id = command[1]
+            delays = self.slow.get(msg_id[1:-1])
+            if delays:
+                time.sleep(delays.pop(0))
+            if msg_id[1:-1] in self.missing:
+                self.wfile.write(b"430 no such article\r\n")
+            else:
+                self.wfile.write(("223 0 " + msg_id + "\r\n").encode())
 
 
 def get_python():
@@ -119,12 +217,117 @@ def run_script():
         stderr=subprocess.PIPE,
         env=os.environ.copy(),
     )
-    out, err = proc.communicate()
+    try:
+        out, err = proc.communicate(timeout=60)
+    except subprocess.TimeoutExpired:
+        proc.kill()  # hanging script, fails on the return code
+        out, err = proc.communicate()
     proc.pid
     ret_code = proc.returncode
     return (out.decode(), int(ret_code), err.decode())
 
 
+def run_queue_script(
+    event="NZB_DOWNLOADED", queued_file="nzb_filename.queued", nzb_id=1
+):
+    os.environ["NZBNA_NZBNAME"] = "nzb_filename"
+    os.environ["NZBNA_NZBID"] = str(nzb_id)
+    os.environ["NZBNA_EVENT"] = event
+    os.environ["NZBNA_QUEUEDFILE"] = queued_file
+    server = http.server.HTTPServer((HOST, int(PORT)), NZBGetServer)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    result = run_script()
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    del os.environ["NZBNA_NZBNAME"]
+    del os.environ["NZBNA_NZBID"]
+    del os.environ["NZBNA_EVENT"]
+    del os.environ["NZBNA_QUEUEDFILE"]
+    return result
+
+
+def write_nzb(name, files=2, segments=20):
+    os.makedirs(TMP_DIR, exist_ok=True)
+    nzb_file = TMP_DIR + os.sep + name + ".nzb.queued"
+    with open(nzb_file, "w", encoding="utf-8") as f:
+        f.write("<nzb>\n")
+        for n in range(files):
+            f.write('<file subject="' + name + ".part" + str(n) + '.rar">\n')
+            f.write("<groups><group>alt.binaries.test</group></groups>\n")
+            f.write("<segments>\n")
+            for m in range(segments):
+                f.write(
+                    '<segment bytes="1" number="' + str(m + 1) + '">'
+                    + name + str(n) + "-" + str(m) + "@test</segment>\n"
+                )
+            f.write("</segments></file>\n")
+        f.write("</nzb>\n")
+    return nzb_file
+
+
+def paused_nzb(nzb_id, nzb_file, age, dupe_key="", dupe_score=0, status="PAUSED"):
+    return {
+        "NZBID": nzb_id,
+        "Status": status,
+        "MaxPriority": 0,
+        "MinPostTime": int(time.time()) - age,
+        "MaxPostTime": int(time.time()) - age,
+        "CriticalHealth": 900,
+        "DupeKey": dupe_key,
+        "DupeScore": dupe_score,
+        "Parameters": [{"Name": "CnpNZBFileName", "Value": nzb_file}],
+    }
+
+
+def get_free_port():
+    with socketserver.TCPServer((HOST, 0), None) as server:
+        return server.server_address[1]
+
+
+def start_nntp_server(port=0):
+    server = socketserver.ThreadingTCPServer(
+        (HOST, port), NNTPServer, bind_and_activate=False
+    )
+    server.allow_reuse_address = True
+    server.daemon_threads = True
+    server.server_bind()
+    server.server_activate()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    return (server, thread)
+
+
+def stop_nntp_server(server, thread):
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def set_news_server(n, port):
+    options = {
+        "Active": "yes",
+        "Level": "0",
+        "Group": "0",
+        "Host": HOST,
+        "Port": str(port),
+        "Username": "",
+        "Password": "",
+        "Encryption": "no",
+        "Connections": "4",
+        "Retention": "0",
+    }
+    for name, value in options.items():
+        os.environ["NZBOP_Server" + str(n) + "." + name] = value
+
+
+def del_news_server(n):
+    for name in list(os.environ):
+        if name.startswith("NZBOP_Server" + str(n) + "."):
+            del os.environ[name]
+
+
 def set_defaults_env():
     # NZBGet global options
     os.environ["NZBOP_CONTROLPORT"] = PORT
@@ -168,6 +371,78 @@ class Tests(unittest.TestCase):
         del os.environ["NZBNA_QUEUEDFILE"]
         self.assertEqual(code, 0)
 
+    def test_queue_mode_stale_event(self):
+        set_defaults_env()
+        events_dir = os.sep.join([TMP_DIR, "completion", "events"])
+        os.makedirs(events_dir, exist_ok=True)
+        # events left half written by a failed call
+        stale_event = events_dir + os.sep + "1000.000000-1.json.tmp"
+        new_event = events_dir + os.sep + "2000.000000-2.json.tmp"
+        for f_name in (stale_event, new_event):
+            with open(f_name, "w", encoding="utf-8") as f:
+                f.write('{"time": ')
+        os.utime(stale_event, (time.time() - 3600, time.time() - 3600))
+        [out, code, err] = run_queue_script()
+        stale_exists = os.path.exists(stale_event)
+        new_exists = os.path.exists(new_event)
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertFalse(stale_exists)
+        self.assertTrue(new_exists)
+
+    def test_queue_mode_legacy_lock(self):
+        set_defaults_env()
+        os.makedirs(TMP_DIR + os.sep + "completion", exist_ok=True)
+        lock_file = os.sep.join([TMP_DIR, "completion", "completion.lock"])
+        with open(lock_file, "w", encoding="utf-8") as f:
+            f.write("1729290000")  # NZBGet server time, older versions
+        [out, code, err] = run_queue_script()
+        with open(lock_file, encoding="utf-8") as f:
+            lock = f.read()
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertNotIn("ended unexpectedly", out)
+        self.assertEqual(lock, "")
+
+    def test_queue_mode_crashed_lock(self):
+        set_defaults_env()
+        os.makedirs(TMP_DIR + os.sep + "completion", exist_ok=True)
+        lock_file = os.sep.join([TMP_DIR, "completion", "completion.lock"])
+        with open(lock_file, "w", encoding="utf-8") as f:
+            f.write("12345 2024-01-01 10:00:00\n")  # not released
+        [out, code, err] = run_queue_script()
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertIn("Previous check (PID 12345) ended unexpectedly", out)
+
+    @unittest.skipIf(os.name == "nt", "fcntl lock")
+    def test_queue_mode_lock_held(self):
+        import fcntl
+
+        set_defaults_env()
+        events_dir = os.sep.join([TMP_DIR, "completion", "events"])
+        os.makedirs(events_dir, exist_ok=True)
+        lock_file = os.sep.join([TMP_DIR, "completion", "completion.lock"])
+        with open(lock_file, "w", encoding="utf-8") as f:
+            f.write("%d 2024-01-01 10:00:00\n" % os.getpid())
+            f.flush()
+            fcntl.flock(f, fcntl.LOCK_EX)  # check running in this process
+            [out, code, err] = run_queue_script()
+            events = os.listdir(events_dir)
+            f.truncate(0)  # released normally
+            f.flush()
+            fcntl.flock(f, fcntl.LOCK_UN)
+        # the queued event is handled by the next call
+        [out_next, code_next, err_next] = run_queue_script()
+        events_next = os.listdir(events_dir)
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0].endswith(".json"))
+        self.assertEqual(code_next, 0)
+        self.assertEqual(events_next, [])
+        self.assertNotIn("ended unexpectedly", out_next)
+
     def test_scan_mode(self):
         set_defaults_env()
         os.environ["NZBNP_NZBNAME"] = "nzb_filename"
@@ -185,6 +460,603 @@ class Tests(unittest.TestCase):
         del os.environ["NZBNP_CATEGORY"]
         self.assertEqual(code, 0)
 
+    def test_scan_mode_compressed_nzb(self):
+        set_defaults_env()
+        os.makedirs(TMP_DIR, exist_ok=True)
+        nzb_file = TMP_DIR + os.sep + "compressed.nzb"
+        with gzip.open(nzb_file, "wt", encoding="utf-8") as f:
+            f.write(
+                '<nzb><file subject="test.rar"><groups><group>alt.binaries.test'
+                + '</group></groups><segments><segment bytes="1" number="1">'
+                + "id1@test</segment></segments></file></nzb>"
+            )
+        os.environ["NZBNP_NZBNAME"] = "compressed"
+        os.environ["NZBNP_CATEGORY"] = "Movies"
+        os.environ["NZBNP_FILENAME"] = nzb_file
+        os.environ["NZBOP_NZBDIR"] = TMP_DIR
+        [out, code, err] = run_script()
+        plan_file = os.sep.join(
+            [TMP_DIR, "completion", "plans", "compressed.nzb.queued.json"]
+        )
+        with open(plan_file, encoding="utf-8") as f:
+            plan = json.load(f)
+        del os.environ["NZBNP_NZBNAME"]
+        del os.environ["NZBNP_CATEGORY"]
+        del os.environ["NZBNP_FILENAME"]
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertIn("[NZB] PAUSED=1", out)
+        self.assertEqual(plan["articles"]["msg_ids"], ["id1@test"])
+
+    def test_scan_mode_corrupt_compressed_nzb(self):
+        set_defaults_env()
+        os.makedirs(TMP_DIR, exist_ok=True)
+        nzb_file = TMP_DIR + os.sep + "corrupt.nzb"
+        data = gzip.compress(
+            (
+                '<nzb><file subject="test.rar"><groups><group>alt.binaries.test'
+                + "</group></groups><segments>"
+                + "".join(
+                    '<segment bytes="1" number="1">id' + str(n) + "@test</segment>"
+                    for n in range(500)
+                )
+                + "</segments></file></nzb>"
+            ).encode("utf-8")
+        )
+        with open(nzb_file, "wb") as f:
+            f.write(data[:10] + b"\xff" * 20 + data[30:])  # damaged deflate data
+        os.environ["NZBNP_NZBNAME"] = "corrupt"
+        os.environ["NZBNP_CATEGORY"] = "Movies"
+        os.environ["NZBNP_FILENAME"] = nzb_file
+        os.environ["NZBOP_NZBDIR"] = TMP_DIR
+        [out, code, err] = run_script()
+        del os.environ["NZBNP_NZBNAME"]
+        del os.environ["NZBNP_CATEGORY"]
+        del os.environ["NZBNP_FILENAME"]
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertIn("[ERROR] Failed to read NZB file", out)
+        self.assertNotIn("Traceback", err)
+
+    def test_queue_mode_check_articles(self):
+        set_defaults_env()
+        nzb_file = write_nzb("checked")
+        NNTPServer.missing = {"checked0-0@test", "checked1-0@test"}
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        NZBGetServer.listgroups = [paused_nzb(1, nzb_file, 3600)]
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_file)
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NNTPServer.missing = set()
+        del_news_server(1)
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertIn("Failed ratio for server: 127.0.0.1: 5.0%", out)
+        self.assertIn('Resuming: "' + nzb_file + '"', out)
+
+    def test_queue_mode_check_dupes(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_CheckDupes"] = "yes"
+        nzb_file = write_nzb("queued")
+        best_file = write_nzb("best")
+        complete_file = write_nzb("complete")
+        lower_file = write_nzb("lower")
+        NNTPServer.missing = set()
+        for name in ("queued", "best", "lower"):
+            NNTPServer.missing.update(name + "0-" + str(m) + "@test" for m in range(20))
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        # incomplete, within AgeLimit so the DUPEs are checked
+        NZBGetServer.listgroups = [paused_nzb(1, nzb_file, 3600, "key", 0)]
+        # checked in the order of the dupe score, all older than AgeLimit
+        age = 10 * 24 * 3600
+        NZBGetServer.history = [
+            paused_nzb(4, lower_file, age, "key", 1, "DELETED/DUPE"),
+            paused_nzb(2, best_file, age, "key", 10, "DELETED/DUPE"),
+            paused_nzb(3, complete_file, age, "key", 5, "DELETED/DUPE"),
+        ]
+        NZBGetServer.edits = []
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_file)
+        edits = NZBGetServer.edits
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NZBGetServer.history = []
+        NZBGetServer.edits = []
+        NNTPServer.missing = set()
+        del_news_server(1)
+        del os.environ["NZBPO_CheckDupes"]
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertIn('Resuming DUPE: "' + complete_file + '"', out)
+        # the failing DUPE with a higher score is marked BAD
+        self.assertIn(("HistoryMarkBad", [2]), edits)
+        self.assertIn(("HistoryRedownload", [3]), edits)
+        self.assertIn(("GroupDupeDelete", [1]), edits)
+        # the DUPE with a lower score is left alone after the resume
+        self.assertFalse(any(4 in ids for command, ids in edits))
+
+    def test_queue_mode_hedged_request(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        os.environ["NZBPO_Extreme"] = "Yes"
+        nzb_file = write_nzb("hedged")
+        NNTPServer.missing = set()
+        # answered on the second request, the reply on the first one is late
+        NNTPServer.slow = {"hedged0-0@test": [1.0], "hedged1-0@test": [2.0, 2.0]}
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        NZBGetServer.listgroups = [paused_nzb(1, nzb_file, 3600)]
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_file)
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NNTPServer.slow = {}
+        del_news_server(1)
+        del os.environ["NZBPO_Verbose"]
+        del os.environ["NZBPO_Extreme"]
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertRegex(out, r"No reply after [\d.]+ sec, requesting hedged0-0@test")
+        self.assertIn("Ignored: 223 0 <hedged0-0@test>", out)
+        self.assertIn("Failed ratio for server: 127.0.0.1: 0%", out)
+        self.assertNotIn("Reconnecting", out)
+        self.assertIn('Resuming: "' + nzb_file + '"', out)
+
+    def test_queue_mode_stalled_request(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        nzb_file = write_nzb("stalled")
+        NNTPServer.missing = set()
+        # no reply in time on both requests, counted as failed
+        NNTPServer.slow = {"stalled0-0@test": [4.0, 4.0]}
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        NZBGetServer.listgroups = [paused_nzb(1, nzb_file, 3600)]
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_file)
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NNTPServer.slow = {}
+        del_news_server(1)
+        del os.environ["NZBPO_Verbose"]
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertIn("requesting stalled0-0@test again", out)
+        self.assertIn("Still no data received after waiting for 3 sec", out)
+        self.assertIn("Failed ratio for server: 127.0.0.1: 2.5%", out)
+        self.assertIn('Resuming: "' + nzb_file + '"', out)
+
+    def test_queue_mode_overview(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        os.environ["NZBPO_OverviewAge"] = "24"
+        nzb_file = write_nzb("overview")
+        NNTPServer.missing = set()
+        # 60000 articles in 12 hours, the NZB is posted from 6 till 1 hour ago
+        now = int(time.time())
+        group = [
+            ("filler" + str(n) + "@test", now - 43200 + 0.72 * n) for n in range(60000)
+        ]
+        for n in range(40):
+            msg_id = "overview" + str(n // 20) + "-" + str(n % 20) + "@test"
+            group.append((msg_id, now - 21600 + 450 * n))
+        NNTPServer.group = sorted(group, key=lambda article: article[1])
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        nzb = paused_nzb(1, nzb_file, 3600)
+        nzb["MinPostTime"] = now - 21600
+        NZBGetServer.listgroups = [nzb]
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_file)
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NNTPServer.group = []
+        del_news_server(1)
+        del os.environ["NZBPO_OverviewAge"]
+        del os.environ["NZBPO_Verbose"]
+        clean_up()
+        self.assertEqual(code, 0)
+        # the first articles are found, posted hours before the age of the NZB
+        self.assertIn("Overview of alt.binaries.test: 40 of 40 articles found", out)
+        self.assertIn('Resuming: "' + nzb_file + '"', out)
+
+    def test_queue_mode_nzb_check_time(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        os.environ["NZBPO_MaxNzbCheckTime"] = "1"
+        nzb_deferred = write_nzb("deferred")
+        nzb_decided = write_nzb("decided")
+        NNTPServer.missing = set()
+        # 4 connections answering 4 articles a sec, ~16 articles in the budget
+        NNTPServer.slow = {
+            name + str(f) + "-" + str(s) + "@test": [0.25, 0.25]
+            for name in ("deferred", "decided")
+            for f in range(2)
+            for s in range(20)
+        }
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        NZBGetServer.edits = []
+        # a failed limit of 10%, and 50% which the estimate can decide
+        decided = paused_nzb(2, nzb_decided, 3600)
+        decided["CriticalHealth"] = 500
+        NZBGetServer.listgroups = [paused_nzb(1, nzb_deferred, 7200), decided]
+        start = time.time()
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_deferred)
+        elapsed = time.time() - start
+        stop_nntp_server(nntp_server, nntp_thread)
+        edits = NZBGetServer.edits
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NZBGetServer.edits = []
+        NNTPServer.slow = {}
+        del_news_server(1)
+        del os.environ["NZBPO_MaxNzbCheckTime"]
+        del os.environ["NZBPO_Verbose"]
+        clean_up()
+        self.assertEqual(code, 0)
+        estimates = re.findall(
+            r"Check time ran out, failed ratio 0.0% \(95% confidence: below "
+            + r"([\d.]+)%\) based on (\d+) of 40 articles",
+            out,
+        )
+        self.assertEqual(len(estimates), 2)
+        for upper, answered in estimates:
+            self.assertLess(int(answered), 40)
+            self.assertGreater(float(upper), 10)
+            self.assertLess(float(upper), 50)
+        self.assertIn('"' + nzb_deferred + '", remains paused for next check', out)
+        self.assertNotIn(("GroupResume", [1]), edits)
+        self.assertIn('Resuming: "' + nzb_decided + '"', out)
+        self.assertIn(("GroupResume", [2]), edits)
+        self.assertIn("[V] Downloading for NZBGet resumed", out)
+        # two NZBs of 1 sec, and the replies still on the way
+        self.assertLess(elapsed, 12)
+
+    def test_queue_mode_check_time(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        os.environ["NZBPO_MaxCheckTime"] = "1"
+        nzb_first = write_nzb("first")
+        nzb_second = write_nzb("second")
+        NNTPServer.missing = set()
+        NNTPServer.slow = {
+            "first" + str(f) + "-" + str(s) + "@test": [0.25, 0.25]
+            for f in range(2)
+            for s in range(20)
+        }
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        NZBGetServer.listgroups = [
+            paused_nzb(1, nzb_first, 7200),
+            paused_nzb(2, nzb_second, 3600),
+        ]
+        start = time.time()
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_first)
+        elapsed = time.time() - start
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NNTPServer.slow = {}
+        del_news_server(1)
+        del os.environ["NZBPO_MaxCheckTime"]
+        del os.environ["NZBPO_Verbose"]
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertRegex(out, r"Check time ran out, failed ratio 0.0% \(95% confidence")
+        self.assertIn('"' + nzb_first + '", remains paused for next check', out)
+        self.assertIn("MaxCheckTime of 1 sec used, remaining NZBs are checked", out)
+        self.assertNotIn('Checking: "' + nzb_second + '"', out)
+        self.assertIn("[V] Downloading for NZBGet resumed", out)
+        self.assertLess(elapsed, 8)
+
+    def test_queue_mode_lost_connection(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        nzb_file = write_nzb("lost")
+        NNTPServer.missing = set()
+        NNTPServer.drop_after = 5
+        NNTPServer.drops = 2
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        NZBGetServer.listgroups = [paused_nzb(1, nzb_file, 3600)]
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_file)
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NNTPServer.drop_after = 0
+        NNTPServer.drops = None
+        del_news_server(1)
+        del os.environ["NZBPO_Verbose"]
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertEqual(out.count("Reconnecting to 127.0.0.1"), 2)
+        # the requests on the lost connections are not counted missing
+        self.assertIn("Failed ratio for server: 127.0.0.1: 0%", out)
+        self.assertIn('Resuming: "' + nzb_file + '"', out)
+
+    def test_queue_mode_reconnect_limit(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        nzb_file = write_nzb("limit")
+        NNTPServer.missing = set()
+        NNTPServer.drop_after = 5  # each connection is lost
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        os.environ["NZBOP_Server1.Connections"] = "1"
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        NZBGetServer.listgroups = [paused_nzb(1, nzb_file, 3600)]
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_file)
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NNTPServer.drop_after = 0
+        del_news_server(1)
+        del os.environ["NZBPO_Verbose"]
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertEqual(out.count("Reconnecting to 127.0.0.1"), 3)
+        self.assertIn("Lost all connections to server: 127.0.0.1", out)
+        self.assertIn("Failed ratio for server: 127.0.0.1: 100%", out)
+        self.assertIn("remains paused for next check", out)
+
+    def test_queue_mode_circuit_breaker(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        nzb_file = write_nzb("breaker")
+        port = get_free_port()  # news server down
+        set_news_server(1, port)
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        # older than AgeLimit, marked BAD when incomplete
+        NZBGetServer.listgroups = [paused_nzb(1, nzb_file, 10 * 24 * 3600)]
+        outputs = []
+        for run in range(4):
+            outputs.append(run_queue_script("NZB_ADDED", nzb_file))
+        breakers_file = os.sep.join([TMP_DIR, "completion", "breakers.json"])
+        with open(breakers_file, encoding="utf-8") as f:
+            breakers = json.load(f)
+        # cooldown over, the news server is up again (half-open)
+        for breaker in breakers.values():
+            breaker[1] -= breaker[2] + 1
+        with open(breakers_file, "w", encoding="utf-8") as f:
+            json.dump(breakers, f)
+        NNTPServer.missing = set()
+        nntp_server, nntp_thread = start_nntp_server(port)
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_file)
+        stop_nntp_server(nntp_server, nntp_thread)
+        with open(breakers_file, encoding="utf-8") as f:
+            breakers_after = json.load(f)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        del_news_server(1)
+        del os.environ["NZBPO_Verbose"]
+        clean_up()
+        for run_out, run_code, run_err in outputs:
+            self.assertEqual(run_code, 0)
+            self.assertNotIn("Marked as BAD", run_out)
+        for run_out, run_code, run_err in outputs[:3]:
+            self.assertIn("remains paused for next check", run_out)
+        self.assertIn("Skipping server 127.0.0.1 for 10 min", outputs[2][0])
+        self.assertIn("postponing check", outputs[3][0])
+        self.assertEqual(code, 0)
+        self.assertIn('Resuming: "' + nzb_file + '"', out)
+        self.assertEqual(breakers_after, {})
+
+    def test_queue_mode_broken_fill_server(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        os.environ["NZBPO_FillServers"] = "2"
+        nzb_file = write_nzb("fill")
+        NNTPServer.missing = {"fill0-" + str(m) + "@test" for m in range(20)}
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        set_news_server(2, get_free_port())  # FillServer down
+        os.environ["NZBOP_Server2.Level"] = "1"
+        NZBGetServer.news_servers = [
+            {"ID": 1, "Active": True},
+            {"ID": 2, "Active": True},
+        ]
+        NZBGetServer.listgroups = [paused_nzb(1, nzb_file, 10 * 24 * 3600)]
+        outputs = []
+        for run in range(4):  # circuit breaker of the FillServer opens
+            outputs.append(run_queue_script("NZB_ADDED", nzb_file))
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NNTPServer.missing = set()
+        del_news_server(1)
+        del_news_server(2)
+        del os.environ["NZBPO_FillServers"]
+        del os.environ["NZBPO_Verbose"]
+        clean_up()
+        for out, code, err in outputs:
+            self.assertEqual(code, 0)
+            self.assertIn("News server skipped after failures", out)
+            self.assertIn("remains paused for next check", out)
+            self.assertNotIn("Marked as BAD", out)
+        self.assertIn("waiting for the circuit breaker cooldown", outputs[3][0])
+
+    def test_queue_mode_sweep_cursor(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        first_file = write_nzb("first")
+        second_file = write_nzb("second")
+        NNTPServer.missing = set()
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        # the NZBs remain paused in the test data, the oldest is checked first
+        NZBGetServer.listgroups = [
+            paused_nzb(1, first_file, 2 * 3600),
+            paused_nzb(2, second_file, 3600),
+        ]
+        outputs = []
+        for run in range(3):
+            outputs.append(run_queue_script("NZB_ADDED", first_file))
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        del_news_server(1)
+        del os.environ["NZBPO_Verbose"]
+        clean_up()
+        for out, code, err in outputs:
+            self.assertEqual(code, 0)
+        self.assertIn('Resuming: "' + first_file + '"', outputs[0][0])
+        self.assertNotIn('Checking: "' + second_file + '"', outputs[0][0])
+        # the NZB checked in the earlier run is skipped
+        self.assertNotIn('Checking: "' + first_file + '"', outputs[1][0])
+        self.assertIn('Resuming: "' + second_file + '"', outputs[1][0])
+        self.assertIn("starting a new round", outputs[2][0])
+        self.assertIn('Resuming: "' + first_file + '"', outputs[2][0])
+
+    def test_queue_mode_result_cache(self):
+        clean_up()
+        set_defaults_env()
+        nzb_file = write_nzb("cached")
+        NNTPServer.missing = set()
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        NZBGetServer.listgroups = [paused_nzb(1, nzb_file, 3600)]
+        [out, code, err] = run_queue_script("NZB_ADDED", nzb_file)
+        # same NZB added again
+        copy_file = TMP_DIR + os.sep + "cached.nzb.2.queued"
+        shutil.copy(nzb_file, copy_file)
+        NZBGetServer.listgroups = [paused_nzb(2, copy_file, 3600)]
+        [out_copy, code_copy, err_copy] = run_queue_script("NZB_ADDED", copy_file, 2)
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        del_news_server(1)
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertIn("Requested [40/40] articles", out)
+        self.assertEqual(code_copy, 0)
+        self.assertIn("Same NZB checked 0.0 hours ago, failed ratio: 0%", out_copy)
+        self.assertIn("Requested [20/20] articles", out_copy)  # the sample only
+        self.assertIn('Resuming: "' + copy_file + '"', out_copy)
+
+    def test_queue_mode_known_takedowns(self):
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Verbose"] = "Yes"
+        nzb_file = write_nzb("takedown")
+        NNTPServer.missing = {"takedown0-" + str(m) + "@test" for m in range(20)}
+        nntp_server, nntp_thread = start_nntp_server()
+        set_news_server(1, nntp_server.server_address[1])
+        NZBGetServer.news_servers = [{"ID": 1, "Active": True}]
+        outputs = []
+        for run in range(3):
+            copy_file = nzb_file
+            if run > 0:
+                # same articles added again
+                copy_file = nzb_file + "." + str(run + 1)
+                shutil.copy(nzb_file, copy_file)
+            if run == 2:
+                NNTPServer.missing = set()  # articles available again
+            NZBGetServer.listgroups = [
+                paused_nzb(run + 1, copy_file, 10 * 24 * 3600)
+            ]
+            outputs.append(run_queue_script("NZB_ADDED", copy_file, run + 1))
+        stop_nntp_server(nntp_server, nntp_thread)
+        NZBGetServer.news_servers = None
+        NZBGetServer.listgroups = None
+        NNTPServer.missing = set()
+        del_news_server(1)
+        del os.environ["NZBPO_Verbose"]
+        clean_up()
+        for out, code, err in outputs:
+            self.assertEqual(code, 0)
+        # the check stops when the failed limit is reached
+        added = re.search(r"Known takedowns: (\d+) added", outputs[0][0])
+        self.assertIsNotNone(added)
+        self.assertIn("Marked as BAD", outputs[0][0])
+        self.assertIn(
+            added.group(1) + " of 40 articles are known takedowns, confirming",
+            outputs[1][0],
+        )
+        self.assertNotIn("Requested [40/40] articles", outputs[1][0])
+        self.assertIn("Marked as BAD", outputs[1][0])
+        self.assertIn("Takedowns not confirmed, checking all articles", outputs[2][0])
+        self.assertIn("Resuming", outputs[2][0])
+
+    @unittest.skipIf(os.name == "nt", "AF_UNIX socket")
+    def test_queue_mode_daemon(self):
+        def wait_for_log(message):
+            end_time = time.time() + 20
+            while time.time() < end_time:
+                if any(message in line for line in NZBGetServer.log):
+                    return True
+                time.sleep(0.1)
+            return False
+
+        clean_up()
+        set_defaults_env()
+        os.environ["NZBPO_Daemon"] = "Yes"
+        os.environ["NZBPO_Verbose"] = "Yes"
+        NZBGetServer.log = []
+        server = http.server.ThreadingHTTPServer((HOST, int(PORT)), NZBGetServer)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        os.environ["NZBNA_NZBNAME"] = "nzb_filename"
+        os.environ["NZBNA_EVENT"] = "NZB_DOWNLOADED"
+        os.environ["NZBNA_QUEUEDFILE"] = "daemon_event.queued"
+        [out, code, err] = run_script()
+        handled = wait_for_log("Completion: daemon_event.queued")
+        # other options, the daemon is replaced and the event checked here
+        os.environ["NZBPO_MaxFailure"] = "5"
+        os.environ["NZBNA_QUEUEDFILE"] = "restart_event.queued"
+        [out_restart, code_restart, err_restart] = run_script()
+        stopped = wait_for_log("Completion: Completion daemon stopped")
+        daemon_log = list(NZBGetServer.log)
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        del os.environ["NZBNA_NZBNAME"]
+        del os.environ["NZBNA_EVENT"]
+        del os.environ["NZBNA_QUEUEDFILE"]
+        del os.environ["NZBPO_MaxFailure"]
+        del os.environ["NZBPO_Daemon"]
+        del os.environ["NZBPO_Verbose"]
+        NZBGetServer.log = []
+        socket_exists = os.path.exists(
+            os.sep.join([TMP_DIR, "completion", "completion.sock"])
+        )
+        clean_up()
+        self.assertEqual(code, 0)
+        self.assertIn("Event send to daemon, reply: ok", out)
+        self.assertNotIn("daemon_event.queued", out)  # checked by the daemon
+        self.assertTrue(handled)
+        self.assertIn("Completion: Completion daemon started", daemon_log)
+        self.assertEqual(code_restart, 0)
+        self.assertIn("Event send to daemon, reply: restart", out_restart)
+        self.assertIn("restart_event.queued", out_restart)
+        self.assertTrue(stopped)
+        self.assertFalse(any("restart_event.queued" in line for line in daemon_log))
+        self.assertFalse(socket_exists)
+
     def test_manifest(self):
         with open(ROOT + "/manifest.json", encoding="utf-8") as file:
             try: